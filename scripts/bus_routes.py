@@ -0,0 +1,37 @@
+
+import pandas as pd
+
+# ROUTE_ID and DESCRIPTION for bus lines, parsed from LONGNAME over the whole
+# table at once. A LONGNAME looks like "52-1 SB KOSTNER ...": ROUTE_ID is the
+# first word up to any "-", DESCRIPTION is the ROUTE_ID plus everything after
+# the second word, cut to 50 characters.
+
+ROUTE_ID_LENGTH = 5
+DESCRIPTION_LENGTH = 50
+
+def parse_longnames(longnames):
+
+    # returns (ROUTE_ID, DESCRIPTION, REASON). names that can't be parsed get a
+    # REASON and None for ROUTE_ID / DESCRIPTION
+    names = longnames.astype(object).where(longnames.notna(), "").astype(str).str.strip()
+
+    # an all-blank (or empty) column splits into no columns at all, so pad to three
+    # and keep every column as text for the str operations below
+    words = names.str.split(n = 2, expand = True).reindex(index = names.index, columns = [0, 1, 2])
+    words = words.astype(object).where(words.notna(), "").astype(str)
+
+    route_id = words[0].str.split("-").str[0].astype(str)
+    desc = (route_id + " " + words[2]).str.slice(0, DESCRIPTION_LENGTH)
+
+    reason = pd.Series(None, index = names.index, dtype = object)
+    reason[words[2] == ""] = "fewer than 3 words"
+    reason[route_id == ""] = "no route id"
+    reason[route_id.str.len() > ROUTE_ID_LENGTH] = f"route id longer than {ROUTE_ID_LENGTH}"
+    reason[names == ""] = "no LONGNAME"
+
+    bad = reason.notna()
+    route_id = route_id.astype(object).where(~bad, None)
+    desc = desc.astype(object).where(~bad, None)
+    reason = reason.astype(object).where(bad, None)
+
+    return route_id, desc, reason
@@ -0,0 +1,255 @@
+
+import os
+import sys
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+
+# Streams the migrated network and transit lines out of MHN_new.gdb as Emme
+# batch-in transaction files:
+#   network.d211           hwynet_node / hwynet_arc (BASELINK = '1')
+#   transit_<x>.d221       bus_<x> / bus_<x>_itin in itinerary order (or the
+#                          bus_<x>_itin_path / _line store where the build has one)
+# Rows are pulled from attribute-only cursors in chunks, formatted a whole chunk
+# at a time with pandas string operations and written with one write per chunk,
+# so memory stays bounded by the chunk size.
+#
+# python emme_export.py <path to MHN_new.gdb> [output folder]
+
+# zone centroids (and points of entry) occupy the bottom of the NODE range
+CENTROID_MAX = 3649
+# dwell time (minutes) written for segments where stopping is allowed
+DWELL_TIME = 0.01
+# DWELLCODE domain -> Emme dwell time prefix
+DWELL_PREFIX = {"0": "", "1": "#", "2": ">", "3": "<", "4": "+", "5": "*"}
+
+CHUNK_SIZE = 50000
+
+domains = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "input", "mhn_domains")
+
+def mode_letters():
+
+    # MODES code -> Emme mode string, from the "-- ASHThmlb" tail of the HWYMODE descriptions.
+    # buses run on every link open to autos and on transit-only links.
+    hwymode = pd.read_csv(os.path.join(domains, "HWYMODE.csv"), dtype = str)
+    bus_modes = "".join(pd.read_csv(os.path.join(domains, "BUSMODE.csv"), dtype = str)["Code"])
+
+    letters = hwymode["Description"].str.extract(r"--\s*(\w+)\s*$", expand = False).fillna("")
+    letters = letters.where(~letters.str.contains("A"), letters + bus_modes)
+    letters = letters.where(hwymode["Code"] != "400", bus_modes)
+
+    return dict(zip(hwymode["Code"], letters))
+
+def read_chunks(table, fields, where_clause = None, sql_clause = (None, None)):
+
+    import arcpy
+
+    with arcpy.da.SearchCursor(table, fields, where_clause, sql_clause = sql_clause) as scursor:
+        while True:
+            rows = list(itertools.islice(scursor, CHUNK_SIZE))
+            if len(rows) == 0:
+                break
+            yield pd.DataFrame(data = rows, columns = fields)
+
+def store_chunks(gdb, x, fields):
+
+    # itinerary rows rebuilt from bus_<x>_itin_path / _line, a chunk of lines at a time.
+    # the path table holds each distinct run once, so it is far smaller than bus_<x>_itin
+    import itin_store
+
+    path_table = os.path.join(gdb, f"bus_{x}_itin_path")
+    line_table = os.path.join(gdb, f"bus_{x}_itin_line")
+
+    paths = list(read_chunks(path_table, [f for f in fields if f != "TRANSIT_LINE"] + ["PATH_ID"]))
+    lines = list(read_chunks(line_table, ["TRANSIT_LINE", "PATH_ID", "BASE_TIME"]))
+    if len(paths) == 0 or len(lines) == 0:
+        return
+
+    paths = pd.concat(paths, ignore_index = True)
+    lines = pd.concat(lines, ignore_index = True)
+    lines = lines.sort_values("TRANSIT_LINE").reset_index(drop = True)
+
+    path_rows = lines["PATH_ID"].map(paths.groupby("PATH_ID").size()).fillna(0)
+    chunk = (path_rows.cumsum() - path_rows) // CHUNK_SIZE
+
+    for _, chunk_lines in lines.groupby(chunk, sort = True):
+        yield itin_store.expand_itinerary(paths, chunk_lines)[fields]
+
+def text(values):
+
+    # integer fields read with nulls come back as floats; print them without ".0"
+    values = values.fillna(0)
+    if pd.api.types.is_float_dtype(values) and (values % 1 == 0).all():
+        values = values.astype(np.int64)
+
+    return values.astype(str)
+
+def number(values, decimals = 4):
+
+    # fixed point, not "{:g}": that keeps 6 significant digits, which puts 7-digit
+    # state plane coordinates in scientific notation and moves them by feet
+    values = values.fillna(0).astype(float).round(decimals) + 0.0
+    text = values.map(f"{{:.{decimals}f}}".format).str.rstrip("0").str.rstrip(".")
+
+    return text.where(text != "-0", "0")
+
+def write_network(gdb, out_file):
+
+    nodes = os.path.join(gdb, "hwynet", "hwynet_node")
+    arcs = os.path.join(gdb, "hwynet", "hwynet_arc")
+    letters = mode_letters()
+
+    node_fields = ["NODE", "POINT_X", "POINT_Y", "zone17", "capzone17", "IMArea"]
+    arc_fields = ["ANODE", "BNODE", "DIRECTIONS", "MILES", "MODES",
+                  "TYPE1", "TYPE2", "THRULANES1", "THRULANES2",
+                  "POSTEDSPEED1", "POSTEDSPEED2", "THRULANEWIDTH1", "THRULANEWIDTH2",
+                  "PARKLANES1", "PARKLANES2"]
+
+    n_nodes = 0
+    n_links = 0
+    skipped = 0
+
+    with open(out_file, "w", buffering = 1024 * 1024) as f:
+
+        f.write("c MHN highway network\n")
+        f.write("t nodes init\n")
+
+        for df in read_chunks(nodes, node_fields, sql_clause = (None, "ORDER BY NODE")):
+
+            flag = np.where(df["NODE"] <= CENTROID_MAX, "a*", "a")
+            lines = (flag + " " + text(df["NODE"]) + " " + number(df["POINT_X"]) + " " + number(df["POINT_Y"])
+                     + " " + text(df["zone17"]) + " " + text(df["capzone17"]) + " " + text(df["IMArea"]) + "\n")
+
+            f.write("".join(lines))
+            n_nodes += len(df)
+
+        f.write("t links init\n")
+
+        for df in read_chunks(arcs, arc_fields, "BASELINK = '1'"):
+
+            modes = df["MODES"].map(letters).fillna("")
+            keep = modes != ""
+            skipped += int((~keep).sum())
+            df = df[keep]
+            modes = modes[keep]
+
+            # a -> b uses the 1 attributes; b -> a uses the same ones for DIRECTIONS 2
+            # and the 2 attributes for DIRECTIONS 3
+            ab = ("a " + text(df["ANODE"]) + " " + text(df["BNODE"]) + " " + number(df["MILES"]) + " " + modes
+                  + " " + text(df["TYPE1"]) + " " + text(df["THRULANES1"]) + " " + text(df["TYPE1"])
+                  + " " + text(df["POSTEDSPEED1"]) + " " + text(df["THRULANEWIDTH1"]) + " " + text(df["PARKLANES1"]) + "\n")
+
+            two = df["DIRECTIONS"] == "3"
+            ba = ("a " + text(df["BNODE"]) + " " + text(df["ANODE"]) + " " + number(df["MILES"]) + " " + modes
+                  + " " + text(df["TYPE1"].where(~two, df["TYPE2"]))
+                  + " " + text(df["THRULANES1"].where(~two, df["THRULANES2"]))
+                  + " " + text(df["TYPE1"].where(~two, df["TYPE2"]))
+                  + " " + text(df["POSTEDSPEED1"].where(~two, df["POSTEDSPEED2"]))
+                  + " " + text(df["THRULANEWIDTH1"].where(~two, df["THRULANEWIDTH2"]))
+                  + " " + text(df["PARKLANES1"].where(~two, df["PARKLANES2"])) + "\n")
+            ba = ba.where(df["DIRECTIONS"].isin(["2", "3"]), "")
+
+            f.write("".join(ab + ba))
+            n_links += len(df) + int(df["DIRECTIONS"].isin(["2", "3"]).sum())
+
+    print(f"{n_nodes} nodes and {n_links} links written to {out_file} ({skipped} arcs with no modes skipped).")
+
+def write_transit(gdb, x, out_file):
+
+    lines_fc = os.path.join(gdb, "hwynet", f"bus_{x}")
+    itin_table = os.path.join(gdb, f"bus_{x}_itin")
+
+    import arcpy
+    store = arcpy.Exists(os.path.join(gdb, f"bus_{x}_itin_path"))
+    itin_fields = [f.name for f in arcpy.ListFields(os.path.join(gdb, f"bus_{x}_itin_path") if store else itin_table)]
+
+    line_fields = ["TRANSIT_LINE", "MODE", "VEHICLE_TYPE", "HEADWAY", "SPEED", "DESCRIPTION"]
+    headers = pd.concat(read_chunks(lines_fc, line_fields), ignore_index = True) if int(arcpy.management.GetCount(lines_fc)[0]) > 0 \
+        else pd.DataFrame(columns = line_fields)
+
+    desc = headers["DESCRIPTION"].fillna("").str.replace("'", "", regex = False).str[:20]
+    header_text = ("a '" + headers["TRANSIT_LINE"] + "' " + headers["MODE"].fillna("") + " " + text(headers["VEHICLE_TYPE"])
+                   + " " + text(headers["HEADWAY"]) + " " + text(headers["SPEED"]) + " '" + desc + "' 0 0 0\n  path=no\n")
+    header_dict = dict(zip(headers["TRANSIT_LINE"], header_text))
+
+    fields = ["TRANSIT_LINE", "ITIN_A", "ITIN_B", "LAYOVER", "DWELL_CODE", "ZONE_FARE", "LINE_SERV_TIME", "TTF"]
+    fields += ["LINK_STOPS"] if "LINK_STOPS" in itin_fields else []
+
+    n_lines = 0
+    orphans = set()
+    last_line = None
+    last_b = None
+
+    with open(out_file, "w", buffering = 1024 * 1024) as f:
+
+        f.write(f"c MHN bus_{x} transit lines\n")
+        f.write("t lines init\n")
+
+        # read the deduplicated path store instead of the full itinerary when the build has one
+        if store:
+            chunks = store_chunks(gdb, x, ["ITIN_ORDER"] + fields)
+        else:
+            chunks = read_chunks(itin_table, fields, sql_clause = (None, "ORDER BY TRANSIT_LINE, ITIN_ORDER"))
+
+        for df in chunks:
+
+            df = df[fields]
+
+            known = df["TRANSIT_LINE"].isin(header_dict)
+            orphans.update(df.loc[~known, "TRANSIT_LINE"])
+            df = df[known].reset_index(drop = True)
+
+            if len(df) == 0:
+                continue
+
+            # a new line closes the previous one with its last ITIN_B, then starts with its header
+            prev_line = df["TRANSIT_LINE"].shift(1).fillna(last_line if last_line is not None else "")
+            node_b = text(df["ITIN_B"])
+            prev_b = node_b.shift(1).where(df.index > 0, last_b)
+            new_line = df["TRANSIT_LINE"] != prev_line
+            close = new_line & (prev_line != "")
+
+            prefix = ("  " + prev_b + "\n").where(close, "") + df["TRANSIT_LINE"].map(header_dict).where(new_line, "")
+
+            dwell_code = df["DWELL_CODE"].fillna("0")
+            dwell_time = pd.Series(np.where(dwell_code == "1", "0", f"{DWELL_TIME:g}"), index = df.index)
+            us3 = text(df["LINK_STOPS"]) if "LINK_STOPS" in df else "0"
+
+            segment = ("  dwt=" + dwell_code.map(DWELL_PREFIX).fillna("") + dwell_time + " ttf=" + text(df["TTF"])
+                       + " us1=" + number(df["LINE_SERV_TIME"]) + " us2=" + text(df["ZONE_FARE"]) + " us3=" + us3
+                       + " " + text(df["ITIN_A"]))
+            layover = (" lay=" + text(df["LAYOVER"])).where(df["LAYOVER"].fillna(0) > 0, "")
+
+            f.write("".join(prefix + segment + layover + "\n"))
+
+            n_lines += int(new_line.sum())
+            last_line = df["TRANSIT_LINE"].iloc[-1]
+            last_b = node_b.iloc[-1]
+
+        if last_line is not None:
+            f.write(f"  {last_b}\n")
+
+    print(f"{n_lines} bus_{x} lines written to {out_file}.")
+    if orphans:
+        print(f"{len(orphans)} bus_{x}_itin lines have no bus_{x} feature and were skipped.")
+
+def export(gdb, out_path, xes = ["base", "current", "future"]):
+
+    os.makedirs(out_path, exist_ok = True)
+
+    write_network(gdb, os.path.join(out_path, "network.d211"))
+    for x in xes:
+        write_transit(gdb, x, os.path.join(out_path, f"transit_{x}.d221"))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Write Emme batch-in files from MHN_new.gdb.")
+    parser.add_argument("gdb", help = "path to MHN_new.gdb")
+    parser.add_argument("out_path", nargs = "?", help = "output folder (default: emme folder next to the gdb)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.gdb):
+        sys.exit(f"{args.gdb} does not exist.")
+
+    export(args.gdb, args.out_path or os.path.join(os.path.dirname(os.path.abspath(args.gdb)), "emme"))
@@ -0,0 +1,309 @@
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import re
+import pandas as pd
+
+# Cache of source geodatabase tables. Each table (attributes plus geometry as WKB)
+# is stored once as an uncompressed Arrow IPC file, keyed by the geodatabase
+# modification stamp and the table's row/field signature, and read back
+# memory-mapped on later runs instead of going through an arcpy cursor. Field
+# selection and simple where clauses are applied to the cached table, and
+# read_rows streams it one record batch at a time.
+#
+# python extract_cache.py list
+# python extract_cache.py evict <key or table name> [...]
+# python extract_cache.py evict --all
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+GEOMETRY_TOKENS = ["SHAPE@", "SHAPE@XY", "SHAPE@WKB"]
+
+# rows per Arrow record batch, both when filling the cache and when reading it back
+CHUNK_SIZE = 100000
+
+# simple where clauses ("ACTION_CODE <> '2'") are applied to the cached table;
+# anything else is read through an uncached cursor
+WHERE_PATTERN = re.compile(r"^\s*(\w+)\s*(=|<>|!=|<=|>=|<|>)\s*(?:'([^']*)'|(-?\d+(?:\.\d+)?))\s*$")
+
+def default_cache_path():
+
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache")
+
+def gdb_stamp(table):
+
+    # latest modification time of any file in the geodatabase that holds table
+    gdb = table
+    while not gdb.lower().endswith(".gdb") and os.path.dirname(gdb) != gdb:
+        gdb = os.path.dirname(gdb)
+
+    stamp = 0
+    for entry in os.scandir(gdb):
+        if entry.is_file() and not entry.name.endswith(".lock"):
+            stamp = max(stamp, entry.stat().st_mtime_ns)
+
+    return stamp
+
+def table_fields(table):
+
+    # every attribute field plus the geometry as WKB: (field name, arrow type)
+    import arcpy
+
+    arrow_types = {
+        "SmallInteger": pa.int64(), "Integer": pa.int64(), "BigInteger": pa.int64(),
+        "Single": pa.float64(), "Double": pa.float64(),
+        "String": pa.string(), "GUID": pa.string(), "GlobalID": pa.string(),
+        "Date": pa.timestamp("us"), "Blob": pa.binary()
+    }
+
+    fields = []
+    has_geometry = False
+
+    for f in arcpy.ListFields(table):
+        if f.type == "Geometry":
+            has_geometry = True
+        elif f.type in arrow_types:
+            fields.append((f.name, arrow_types[f.type]))
+
+    if has_geometry:
+        fields.append(("SHAPE@WKB", pa.binary()))
+
+    return fields
+
+def table_signature(table):
+
+    # one cache entry per table, whatever fields or rows a caller later asks for
+    import arcpy
+
+    field_info = [[f.name, f.type, f.length] for f in arcpy.ListFields(table)]
+    rows = int(arcpy.management.GetCount(table)[0])
+
+    signature = {
+        "table": os.path.normpath(table),
+        "stamp": gdb_stamp(table),
+        "rows": rows,
+        "fields": field_info
+    }
+
+    key = hashlib.sha1(json.dumps(signature, sort_keys = True).encode()).hexdigest()
+
+    return key, signature
+
+def read_index(cache_path):
+
+    index_file = os.path.join(cache_path, "index.json")
+    if not os.path.exists(index_file):
+        return {}
+
+    with open(index_file, "r") as f:
+        return json.load(f)
+
+def write_index(cache_path, index):
+
+    # write then rename so an interrupted run never leaves a half-written index
+    index_file = os.path.join(cache_path, "index.json")
+    with open(index_file + ".tmp", "w") as f:
+        json.dump(index, f, indent = 2)
+
+    os.replace(index_file + ".tmp", index_file)
+
+def cursor_rows(table, fields, where_clause = None):
+
+    # rows straight from a SearchCursor, geometry as WKB bytes
+    import arcpy
+
+    read_fields = ["SHAPE@WKB" if field in GEOMETRY_TOKENS else field for field in fields]
+    geometry = [i for i, field in enumerate(fields) if field in GEOMETRY_TOKENS]
+
+    with arcpy.da.SearchCursor(table, read_fields, where_clause) as scursor:
+        for row in scursor:
+            if geometry:
+                row = list(row)
+                for i in geometry:
+                    row[i] = None if row[i] is None else bytes(row[i])
+                row = tuple(row)
+            yield row
+
+def read_cursor(table, fields, where_clause = None):
+
+    return pd.DataFrame(data = list(cursor_rows(table, fields, where_clause)), columns = fields)
+
+def write_batches(table, cache_file):
+
+    # fill the cache from one cursor pass, a record batch at a time
+    fields = table_fields(table)
+    schema = pa.schema(fields)
+    names = [name for name, _ in fields]
+
+    with pa.OSFile(cache_file, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+
+            chunk = []
+            for row in cursor_rows(table, names):
+                chunk.append(row)
+                if len(chunk) == CHUNK_SIZE:
+                    writer.write_batch(pa.record_batch([pa.array(c, type = t) for c, (_, t) in zip(zip(*chunk), fields)], schema = schema))
+                    chunk = []
+
+            if chunk:
+                writer.write_batch(pa.record_batch([pa.array(c, type = t) for c, (_, t) in zip(zip(*chunk), fields)], schema = schema))
+
+def cached_file(table, cache_path):
+
+    # path of the table's Arrow file, extracting it first on a miss
+    os.makedirs(cache_path, exist_ok = True)
+
+    key, signature = table_signature(table)
+    cache_file = os.path.join(cache_path, f"{key}.arrow")
+
+    if os.path.exists(cache_file):
+        return cache_file
+
+    write_batches(table, cache_file + ".tmp")
+    os.replace(cache_file + ".tmp", cache_file)
+
+    index = read_index(cache_path)
+    signature["created"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    signature["bytes"] = os.path.getsize(cache_file)
+    index[key] = signature
+    write_index(cache_path, index)
+
+    return cache_file
+
+def column_names(fields, schema_names):
+
+    # cached column for each requested field. arcpy matches field names without
+    # regard to case ("IMAREA" finds IMArea) and Arrow does not, so match them here
+    by_lower = {name.lower(): name for name in schema_names}
+
+    names = []
+    for field in fields:
+        field = "SHAPE@WKB" if field in GEOMETRY_TOKENS else field
+        if field.lower() not in by_lower:
+            raise KeyError(f"{field} is not a field of the cached table.")
+        names.append(by_lower[field.lower()])
+
+    return names
+
+def where_mask(data, where_clause):
+
+    field, op, text, number = WHERE_PATTERN.match(where_clause).groups()
+    field = column_names([field], data.schema.names)[0]
+    value = text if text is not None else float(number)
+    compare = {"=": pc.equal, "<>": pc.not_equal, "!=": pc.not_equal,
+               "<": pc.less, ">": pc.greater, "<=": pc.less_equal, ">=": pc.greater_equal}[op]
+
+    # a comparison with null is null, which drops the row just as the SQL would
+    return pc.fill_null(compare(data.column(field), value), False)
+
+def use_cache(where_clause, cache_path):
+
+    return cache_path is not None and pa is not None and (where_clause is None or WHERE_PATTERN.match(where_clause) is not None)
+
+def arrow_table(cache_file, fields, where_clause = None):
+
+    with pa.memory_map(cache_file, "r") as source:
+        data = pa.ipc.open_file(source).read_all()
+        if where_clause is not None:
+            data = data.filter(where_mask(data, where_clause))
+        df = data.select(column_names(fields, data.schema.names)).to_pandas()
+
+    df.columns = fields
+
+    return df
+
+def arrow_rows(cache_file, fields, where_clause = None):
+
+    with pa.memory_map(cache_file, "r") as source:
+        reader = pa.ipc.open_file(source)
+        names = column_names(fields, reader.schema.names)
+
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if where_clause is not None:
+                batch = batch.filter(where_mask(batch, where_clause))
+
+            yield from zip(*[batch.column(name).to_pylist() for name in names])
+
+def read_table(table, fields, where_clause = None, cache_path = None):
+
+    # geometry tokens come back as WKB bytes, so insert with "SHAPE@WKB"
+    if not use_cache(where_clause, cache_path):
+        return read_cursor(table, fields, where_clause)
+
+    return arrow_table(cached_file(table, cache_path), fields, where_clause)
+
+def read_rows(table, fields, where_clause = None, cache_path = None):
+
+    # same rows a SearchCursor would give, with nulls as None. streams one record
+    # batch at a time so the whole table is never held in memory
+    if not use_cache(where_clause, cache_path):
+        yield from cursor_rows(table, fields, where_clause)
+        return
+
+    yield from arrow_rows(cached_file(table, cache_path), fields, where_clause)
+
+def list_entries(cache_path):
+
+    index = read_index(cache_path)
+
+    print(f"{'KEY':12} {'ROWS':>9} {'MB':>8}  {'CREATED':19}  TABLE")
+    for key, entry in sorted(index.items(), key = lambda item: item[1]["table"]):
+        mb = entry.get("bytes", 0) / 1024 / 1024
+        print(f"{key[:12]} {entry['rows']:>9} {mb:>8.1f}  {entry.get('created', ''):19}  {entry['table']}")
+
+    print(f"{len(index)} cached tables.")
+
+def evict(cache_path, targets = None, evict_all = False):
+
+    index = read_index(cache_path)
+    removed = []
+
+    for key, entry in list(index.items()):
+
+        table_name = os.path.basename(entry["table"])
+        matched = evict_all or any(key.startswith(t) or t in [entry["table"], table_name] for t in targets)
+
+        if matched:
+            cache_file = os.path.join(cache_path, f"{key}.arrow")
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            del index[key]
+            removed.append(key)
+
+    # files left behind by a crashed run are not in the index
+    if evict_all:
+        for entry in os.scandir(cache_path):
+            if entry.name.endswith(".arrow") or entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+
+    write_index(cache_path, index)
+    print(f"Evicted {len(removed)} cached tables.")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Inspect or evict cached source tables.")
+    parser.add_argument("command", choices = ["list", "evict"])
+    parser.add_argument("targets", nargs = "*", help = "cache keys (or key prefixes) or table names to evict")
+    parser.add_argument("--all", action = "store_true", help = "evict every cached table")
+    parser.add_argument("--cache", default = default_cache_path(), help = "cache folder")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.cache):
+        print(f"No cache at {args.cache}.")
+        sys.exit(0)
+
+    if args.command == "list":
+        list_entries(args.cache)
+    elif args.all or args.targets:
+        evict(args.cache, args.targets, args.all)
+    else:
+        parser.error("evict needs a key, a table name or --all")
@@ -0,0 +1,169 @@
+
+import numpy as np
+
+import extract_cache
+
+# Bulk geometry reading from WKB into flat coordinate arrays, laid out the
+# same way as GeoArrow:
+#   coords        (n_points, 2) float64 XY
+#   part_offsets  (n_parts + 1) first point of each part
+#   geom_offsets  (n_geoms + 1) first part of each geometry
+# Only points and (multi)linestrings are handled since those are all the MHN
+# holds. Z and M values are dropped.
+
+POINT = 1
+LINESTRING = 2
+MULTILINESTRING = 5
+
+# BEARING domain codes, clockwise from north
+BEARINGS = np.array(["N", "NE", "E", "SE", "S", "SW", "W", "NW"])
+
+def read_uint32(buf, offsets):
+
+    idx = offsets[:, None] + np.arange(4)
+    return np.ascontiguousarray(buf[idx]).view("<u4").ravel().astype(np.int64)
+
+def gather_coords(buf, starts, counts, dims):
+
+    # byte-gather every XY pair; WKB doubles are not 8-byte aligned so no view on buf
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty((0, 2))
+
+    point_index = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    point_start = np.repeat(starts, counts) + point_index * np.repeat(dims, counts) * 8
+    idx = point_start[:, None] + np.arange(16)
+
+    return np.ascontiguousarray(buf[idx]).view("<f8").reshape(-1, 2)
+
+def wkb_to_arrays(wkbs):
+
+    wkbs = [b"" if wkb is None else bytes(wkb) for wkb in wkbs]
+    n = len(wkbs)
+
+    lengths = np.fromiter((len(wkb) for wkb in wkbs), dtype = np.int64, count = n)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    buf = np.frombuffer(b"".join(wkbs), dtype = np.uint8)
+
+    empty = lengths == 0
+    present = np.flatnonzero(~empty)
+
+    if np.any(buf[starts[present]] != 1):
+        raise ValueError("Only little-endian WKB is supported.")
+
+    gtype = np.zeros(n, dtype = np.int64)
+    gtype[present] = read_uint32(buf, starts[present] + 1)
+
+    # ISO WKB: 1000s digit 1 = Z, 2 = M, 3 = ZM
+    base = gtype % 1000
+    dims = 2 + np.isin(gtype // 1000, [1, 2]) + 2 * (gtype // 1000 == 3)
+
+    if np.any(~np.isin(base[present], [POINT, LINESTRING, MULTILINESTRING])):
+        raise ValueError("Only point and (multi)linestring WKB is supported.")
+
+    # every part as (geometry, first coordinate byte, point count)
+    part_geom = []
+    part_start = []
+    part_count = []
+
+    points = np.flatnonzero((base == POINT) & ~empty)
+    part_geom.append(points)
+    part_start.append(starts[points] + 5)
+    part_count.append(np.ones(len(points), dtype = np.int64))
+
+    lines = np.flatnonzero((base == LINESTRING) & ~empty)
+    part_geom.append(lines)
+    part_start.append(starts[lines] + 9)
+    part_count.append(read_uint32(buf, starts[lines] + 5))
+
+    multi = np.flatnonzero((base == MULTILINESTRING) & ~empty)
+    n_parts = read_uint32(buf, starts[multi] + 5)
+    pos = starts[multi] + 9
+
+    # walk the j-th part of every multilinestring at once
+    for j in range(int(n_parts.max()) if len(multi) > 0 else 0):
+        active = n_parts > j
+        count = read_uint32(buf, pos[active] + 5)
+        part_geom.append(multi[active])
+        part_start.append(pos[active] + 9)
+        part_count.append(count)
+        pos[active] += 9 + count * dims[multi[active]] * 8
+
+    part_geom = np.concatenate(part_geom)
+    part_start = np.concatenate(part_start)
+    part_count = np.concatenate(part_count)
+
+    # parts are collected by type and part number; put them back in geometry order
+    order = np.argsort(part_geom, kind = "stable")
+    part_geom = part_geom[order]
+    part_start = part_start[order]
+    part_count = part_count[order]
+
+    coords = gather_coords(buf, part_start, part_count, dims[part_geom])
+    part_offsets = np.concatenate([[0], np.cumsum(part_count)]).astype(np.int64)
+    geom_offsets = np.concatenate([[0], np.cumsum(np.bincount(part_geom, minlength = n))]).astype(np.int64)
+
+    return coords, part_offsets, geom_offsets
+
+def read_geometry(table, key_field, where_clause = None, cache_path = None):
+
+    # returns (key values, coords, part_offsets, geom_offsets) for a whole table
+    df = extract_cache.read_table(table, [key_field, "SHAPE@WKB"], where_clause, cache_path)
+    coords, part_offsets, geom_offsets = wkb_to_arrays(df["SHAPE@WKB"])
+
+    return df[key_field].to_numpy(), coords, part_offsets, geom_offsets
+
+def geometry_endpoints(coords, part_offsets, geom_offsets):
+
+    # first point of the first part and last point of the last part of each geometry.
+    # NaN for null / empty geometries
+    n_geoms = len(geom_offsets) - 1
+    first = np.full((n_geoms, 2), np.nan)
+    last = np.full((n_geoms, 2), np.nan)
+
+    present = part_offsets[geom_offsets[1:]] > part_offsets[geom_offsets[:-1]]
+
+    first[present] = coords[part_offsets[geom_offsets[:-1][present]]]
+    last[present] = coords[part_offsets[geom_offsets[1:][present]] - 1]
+
+    return first, last
+
+def segments(coords, part_offsets, geom_offsets):
+
+    # (start points, end points, geometry index) of every segment, without joining across parts
+    n_geoms = len(geom_offsets) - 1
+    if len(coords) < 2:
+        return np.empty((0, 2)), np.empty((0, 2)), np.empty(0, dtype = np.int64)
+
+    part_starts = part_offsets[1:-1]
+    valid = np.ones(len(coords) - 1, dtype = bool)
+    valid[part_starts[(part_starts > 0) & (part_starts < len(coords))] - 1] = False
+
+    point_part = np.repeat(np.arange(len(part_offsets) - 1), np.diff(part_offsets))
+    part_geom = np.repeat(np.arange(n_geoms), np.diff(geom_offsets))
+    seg_geom = part_geom[point_part[:-1]]
+
+    return coords[:-1][valid], coords[1:][valid], seg_geom[valid]
+
+def polyline_lengths(coords, part_offsets, geom_offsets):
+
+    # planar length of each geometry in coordinate units
+    a, b, seg_geom = segments(coords, part_offsets, geom_offsets)
+
+    return np.bincount(seg_geom, weights = np.hypot(*(b - a).T), minlength = len(geom_offsets) - 1)
+
+def bearing_classes(first, last):
+
+    # compass bearing from first to last point, binned into the 8 BEARING domain codes.
+    # "X" where the two points coincide, None where there are no points.
+    dx = last[:, 0] - first[:, 0]
+    dy = last[:, 1] - first[:, 1]
+
+    missing = np.isnan(dx) | np.isnan(dy)
+
+    angle = np.degrees(np.arctan2(dx, dy)) % 360
+    bearing = BEARINGS[np.floor(np.where(missing, 0, angle + 22.5) / 45).astype(int) % 8].astype(object)
+    bearing[(dx == 0) & (dy == 0)] = "X"
+    bearing[missing] = None
+
+    return bearing
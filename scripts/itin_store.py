@@ -0,0 +1,69 @@
+
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Deduplicated storage for transit itineraries. Runs of the same route at
+# different start times repeat the same segment sequence, so each distinct
+# sequence is kept once as a path and every TRANSIT_LINE maps to a PATH_ID.
+# DEP_TIME/ARR_TIME are stored on the path as offsets from the run's first
+# departure, with the run's own start kept as BASE_TIME on the line, so runs
+# only share a path when their timing pattern matches too.
+#
+#   paths  PATH_ID, ITIN_ORDER, segment fields, DEP_OFFSET, ARR_OFFSET
+#   lines  TRANSIT_LINE, PATH_ID, BASE_TIME
+#
+# expand_itinerary(paths, lines) gives back the original itinerary rows.
+
+SEGMENT_FIELDS = ["ITIN_A", "ITIN_B", "ABB", "LAYOVER", "DWELL_CODE", "ZONE_FARE",
+                  "LINE_SERV_TIME", "TTF", "LINK_STOPS", "IMPUTED", "F_MEAS", "T_MEAS"]
+
+def build_store(itin_df):
+
+    df = itin_df.sort_values(["TRANSIT_LINE", "ITIN_ORDER"]).reset_index(drop = True)
+    path_fields = ["ITIN_ORDER"] + [field for field in SEGMENT_FIELDS if field in df.columns]
+
+    timed = "DEP_TIME" in df.columns and "ARR_TIME" in df.columns
+    if timed:
+        base_time = df.groupby("TRANSIT_LINE", sort = False)["DEP_TIME"].transform("first")
+        df["BASE_TIME"] = base_time
+        df["DEP_OFFSET"] = df["DEP_TIME"] - base_time
+        df["ARR_OFFSET"] = df["ARR_TIME"] - base_time
+        path_fields += ["DEP_OFFSET", "ARR_OFFSET"]
+    else:
+        df["BASE_TIME"] = 0
+
+    # one hash per row, then one digest per line over its rows in order
+    row_hash = pd.util.hash_pandas_object(df[path_fields], index = False).to_numpy()
+    starts = np.flatnonzero(np.r_[True, df["TRANSIT_LINE"].to_numpy()[1:] != df["TRANSIT_LINE"].to_numpy()[:-1]])
+    ends = np.r_[starts[1:], len(df)]
+
+    line_hash = [hashlib.sha1(row_hash[a:b].tobytes()).hexdigest() for a, b in zip(starts, ends)]
+    path_codes, unique_hashes = pd.factorize(pd.Series(line_hash))
+
+    lines = pd.DataFrame({
+        "TRANSIT_LINE": df["TRANSIT_LINE"].to_numpy()[starts],
+        "PATH_ID": path_codes + 1,
+        "BASE_TIME": df["BASE_TIME"].to_numpy()[starts]
+    })
+
+    # the first line to use each path supplies its rows
+    first_line = lines.drop_duplicates("PATH_ID")
+    paths = df[df["TRANSIT_LINE"].isin(first_line["TRANSIT_LINE"])]
+    paths = paths.merge(first_line[["TRANSIT_LINE", "PATH_ID"]], on = "TRANSIT_LINE")
+    paths = paths[["PATH_ID"] + path_fields].sort_values(["PATH_ID", "ITIN_ORDER"]).reset_index(drop = True)
+
+    return paths, lines
+
+def expand_itinerary(paths, lines):
+
+    df = lines.merge(paths, on = "PATH_ID")
+
+    if "DEP_OFFSET" in df.columns:
+        df["DEP_TIME"] = df["BASE_TIME"] + df["DEP_OFFSET"]
+        df["ARR_TIME"] = df["BASE_TIME"] + df["ARR_OFFSET"]
+        df = df.drop(columns = ["DEP_OFFSET", "ARR_OFFSET"])
+
+    df = df.drop(columns = ["PATH_ID", "BASE_TIME"])
+
+    return df.sort_values(["TRANSIT_LINE", "ITIN_ORDER"]).reset_index(drop = True)
@@ -0,0 +1,170 @@
+
+import os
+import sys
+import time
+import shutil
+import argparse
+
+# Build-then-swap publication of the pipeline output. A run builds into
+# output/staging/<build>, which is moved to output/builds/<build> once its
+# checks pass. output/current always points at the published build (a symlink,
+# or a directory junction on Windows without symlink rights), so readers never
+# see a half-built or deleted MHN_new.gdb. The last few builds are kept for
+# rollback.
+#
+# python publish.py list
+# python publish.py rollback [build]
+
+def default_output_root():
+
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output")
+
+def new_build(output_root):
+
+    build_name = time.strftime("build_%Y%m%d_%H%M%S")
+    staging_path = os.path.join(output_root, "staging", build_name)
+    os.makedirs(staging_path)
+
+    return staging_path
+
+def list_builds(output_root):
+
+    builds_path = os.path.join(output_root, "builds")
+    if not os.path.isdir(builds_path):
+        return []
+
+    return sorted(entry.name for entry in os.scandir(builds_path) if entry.is_dir())
+
+def current_build(output_root):
+
+    current_file = os.path.join(output_root, "CURRENT")
+    if not os.path.exists(current_file):
+        return None
+
+    with open(current_file, "r") as f:
+        return f.read().strip()
+
+def remove_link(path):
+
+    # removes the link itself, never the build it points at
+    if os.name == "nt":
+        os.rmdir(path)
+    else:
+        os.unlink(path)
+
+def switch_current(output_root, build_name):
+
+    # the symlink target is relative to the link's own folder, so it resolves however
+    # output_root was given and keeps working if the output folder is moved
+    target = os.path.join(output_root, "builds", build_name)
+    link_target = os.path.join("builds", build_name)
+    link = os.path.join(output_root, "current")
+    tmp_link = link + ".tmp"
+
+    if not os.path.isdir(target):
+        raise FileNotFoundError(f"No published build {build_name} in {output_root}.")
+
+    if os.path.lexists(tmp_link):
+        remove_link(tmp_link)
+
+    try:
+        # atomic: readers see either the old build or the new one
+        os.symlink(link_target, tmp_link, target_is_directory = True)
+        os.replace(tmp_link, link)
+
+    except OSError:
+        # Windows cannot replace a directory link in place (or create symlinks without
+        # developer mode), so swap a junction instead. readers are only without
+        # output/current for the instant between the two calls.
+        if os.path.lexists(tmp_link):
+            remove_link(tmp_link)
+        if os.path.lexists(link):
+            remove_link(link)
+
+        try:
+            os.symlink(link_target, link, target_is_directory = True)
+        except OSError:
+            # junctions only take absolute targets
+            import _winapi
+            _winapi.CreateJunction(os.path.abspath(target), os.path.abspath(link))
+
+    current_file = os.path.join(output_root, "CURRENT")
+    with open(current_file + ".tmp", "w") as f:
+        f.write(build_name)
+
+    os.replace(current_file + ".tmp", current_file)
+
+def prune_builds(output_root, keep):
+
+    current = current_build(output_root)
+    builds = list_builds(output_root)
+
+    for build_name in builds[:max(len(builds) - keep, 0)]:
+        if build_name != current:
+            shutil.rmtree(os.path.join(output_root, "builds", build_name), ignore_errors = True)
+
+def remove_legacy_output(output_root):
+
+    # before builds were published, each run wrote MHN_new.gdb and its csv reports
+    # straight into output/ (and deleted the folder first). those copies would go
+    # stale from here on, so they are removed the same way the old runs did
+    legacy = [entry for entry in os.scandir(output_root)
+              if entry.name == "MHN_new.gdb" or (entry.is_file() and entry.name.endswith(".csv"))]
+
+    for entry in legacy:
+        if entry.is_dir():
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+    if legacy:
+        print(f"WARNING: removed {len(legacy)} files of the old output layout from {output_root}. "
+              f"Read the network from {os.path.join(output_root, 'current', 'MHN_new.gdb')} instead.")
+
+def publish(output_root, staging_path, keep = 3):
+
+    build_name = os.path.basename(staging_path)
+    build_path = os.path.join(output_root, "builds", build_name)
+
+    os.makedirs(os.path.join(output_root, "builds"), exist_ok = True)
+    os.replace(staging_path, build_path)
+
+    switch_current(output_root, build_name)
+    prune_builds(output_root, keep)
+    remove_legacy_output(output_root)
+
+    return build_path
+
+def rollback(output_root, build_name = None):
+
+    builds = list_builds(output_root)
+    current = current_build(output_root)
+
+    if build_name is None:
+        older = [b for b in builds if current is None or b < current]
+        if len(older) == 0:
+            raise ValueError("No earlier build to roll back to.")
+        build_name = older[-1]
+
+    switch_current(output_root, build_name)
+
+    return build_name
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "List published MHN builds or roll back to one.")
+    parser.add_argument("command", choices = ["list", "rollback"])
+    parser.add_argument("build", nargs = "?", help = "build to roll back to (default: the one before current)")
+    parser.add_argument("--output", default = default_output_root(), help = "output folder")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        current = current_build(args.output)
+        for build_name in list_builds(args.output):
+            print(("* " if build_name == current else "  ") + build_name)
+
+    else:
+        try:
+            print(f"output/current now points at {rollback(args.output, args.build)}.")
+        except (ValueError, FileNotFoundError) as e:
+            sys.exit(str(e))
@@ -0,0 +1,364 @@
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import argparse
+import subprocess
+import shutil
+import pandas as pd
+
+# Golden-output regression harness. Runs transform_schema.py on a fixed fixture
+# MHN into a temporary output folder, then compares the published build with the
+# stored golden snapshot:
+#   - every table and feature class by an order-independent hash of its rows
+#     (geometry as WKB), plus every csv report written to the build. Emme files
+#     are hashed line by line in file order, since itinerary order matters there
+#   - domain violations and relationship-class orphans, which may not grow
+#   - stage times and memory growth from stage_times.csv, which may not exceed
+#     the recorded budget by more than --margin. the pipeline runs with an empty
+#     cache folder, so times are always cold-cache times
+#
+# python regression.py            compare against regression/golden
+# python regression.py --update   record a new snapshot and budgets
+# python regression.py --make-fixture <MHN_old.gdb> --extent "xmin ymin xmax ymax"
+#                                 cut a new fixture out of a full MHN
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+default_fixture = os.path.join(repo_path, "regression", "fixture", "MHN_old.gdb")
+default_golden = os.path.join(repo_path, "regression", "golden")
+
+# stages shorter than this (seconds) are never failed on time; they are all noise
+MIN_SECONDS = 2
+# memory growth within this many MB of the budget is never failed either
+MIN_MB = 50
+
+def row_hash(row):
+
+    values = []
+    for value in row:
+        if isinstance(value, float):
+            value = round(value, 6)
+        elif isinstance(value, (bytes, bytearray)):
+            value = hashlib.sha1(bytes(value)).hexdigest()
+        values.append(repr(value))
+
+    return hashlib.sha1("|".join(values).encode()).hexdigest()
+
+def table_snapshot(table):
+
+    import arcpy
+
+    fields = [f.name for f in arcpy.ListFields(table) if f.type not in ["OID", "Geometry", "GlobalID"]
+              and f.name not in ["Shape_Length", "Shape_Area"]]
+    if arcpy.Describe(table).dataType == "FeatureClass":
+        fields.append("SHAPE@WKB")
+
+    with arcpy.da.SearchCursor(table, fields) as scursor:
+        hashes = sorted(row_hash(row) for row in scursor)
+
+    return {"fields": fields, "rows": len(hashes), "hashes": hashes}
+
+def csv_snapshot(path):
+
+    df = pd.read_csv(path, dtype = str, keep_default_na = False)
+    hashes = sorted(row_hash(row) for row in df.itertuples(index = False, name = None))
+
+    return {"fields": list(df.columns), "rows": len(hashes), "hashes": hashes}
+
+def text_snapshot(path):
+
+    # kept in file order: a reordered itinerary is a different itinerary
+    with open(path, "r") as f:
+        hashes = [hashlib.sha1(line.encode()).hexdigest() for line in f]
+
+    return {"fields": [], "rows": len(hashes), "hashes": hashes}
+
+def list_tables(gdb):
+
+    import arcpy
+
+    arcpy.env.workspace = gdb
+    tables = list(arcpy.ListTables())
+    tables += list(arcpy.ListFeatureClasses())
+    for dataset in arcpy.ListDatasets(feature_type = "Feature"):
+        tables += list(arcpy.ListFeatureClasses(feature_dataset = dataset))
+
+    return sorted(tables)
+
+def domain_violations(gdb, tables):
+
+    import arcpy
+
+    domains = {d.name: d for d in arcpy.da.ListDomains(gdb)}
+    violations = {}
+
+    for table in tables:
+        for field in arcpy.ListFields(table):
+
+            if not field.domain or field.domain not in domains:
+                continue
+
+            domain = domains[field.domain]
+            with arcpy.da.SearchCursor(table, [field.name]) as scursor:
+                values = pd.Series([row[0] for row in scursor]).dropna()
+
+            if domain.domainType == "CodedValue":
+                codes = pd.Series(list(domain.codedValues.keys()))
+                bad = ~values.astype(str).isin(codes.astype(str))
+            else:
+                low, high = domain.range
+                bad = (values < low) | (values > high)
+
+            violations[f"{table}.{field.name}"] = int(bad.sum())
+
+    return violations
+
+def relationship_orphans(gdb):
+
+    import arcpy
+
+    orphans = {}
+
+    # relationship classes sit in the gdb root or in the feature dataset of their classes
+    children = []
+    for child in arcpy.Describe(gdb).children:
+        children += child.children if child.dataType == "FeatureDataset" else [child]
+
+    for child in children:
+
+        if child.dataType != "RelationshipClass":
+            continue
+
+        keys = dict((role, field) for field, role, _ in child.originClassKeys)
+        origin = child.originClassNames[0]
+        destination = child.destinationClassNames[0]
+
+        with arcpy.da.SearchCursor(origin, [keys["OriginPrimary"]]) as scursor:
+            parents = set(row[0] for row in scursor)
+        with arcpy.da.SearchCursor(destination, [keys["OriginForeign"]]) as scursor:
+            foreign_keys = [row[0] for row in scursor]
+
+        orphans[child.name] = sum(1 for key in foreign_keys if key not in parents)
+
+    return orphans
+
+def snapshot(build_path):
+
+    gdb = os.path.join(build_path, "MHN_new.gdb")
+    tables = list_tables(gdb)
+
+    snap = {"tables": {}, "reports": {}}
+    for table in tables:
+        snap["tables"][table] = table_snapshot(table)
+
+    for file_name in sorted(os.listdir(build_path)):
+        if file_name.endswith(".csv") and file_name != "stage_times.csv":
+            snap["reports"][file_name] = csv_snapshot(os.path.join(build_path, file_name))
+
+    emme_path = os.path.join(build_path, "emme")
+    if os.path.isdir(emme_path):
+        for file_name in sorted(os.listdir(emme_path)):
+            snap["reports"][f"emme/{file_name}"] = text_snapshot(os.path.join(emme_path, file_name))
+
+    snap["domains"] = domain_violations(gdb, tables)
+    snap["relationships"] = relationship_orphans(gdb)
+
+    return snap
+
+def compare_snapshots(golden, current):
+
+    failures = []
+
+    for group in ["tables", "reports"]:
+        for name in sorted(set(golden[group]) | set(current[group])):
+
+            if name not in current[group]:
+                failures.append(f"{name} is missing from the output.")
+                continue
+            if name not in golden[group]:
+                failures.append(f"{name} is new (not in the golden snapshot).")
+                continue
+
+            old = golden[group][name]
+            new = current[group][name]
+
+            if old["fields"] != new["fields"]:
+                failures.append(f"{name} fields changed: {old['fields']} -> {new['fields']}.")
+            elif old["hashes"] != new["hashes"]:
+                old_rows = pd.Series(old["hashes"]).value_counts()
+                new_rows = pd.Series(new["hashes"]).value_counts()
+                diff = new_rows.sub(old_rows, fill_value = 0)
+                if (diff == 0).all():
+                    failures.append(f"{name} lines are in a different order.")
+                else:
+                    failures.append(f"{name} rows changed: {int(diff[diff > 0].sum())} added, {int(-diff[diff < 0].sum())} removed.")
+
+    for group in ["domains", "relationships"]:
+        for name, count in current[group].items():
+            if count > golden[group].get(name, 0):
+                failures.append(f"{group} check {name}: {count} bad rows (golden {golden[group].get(name, 0)}).")
+
+    return failures
+
+def compare_budgets(budgets, stage_df, margin):
+
+    failures = []
+
+    for row in stage_df.itertuples(index = False):
+
+        if row.STAGE not in budgets:
+            failures.append(f"Stage '{row.STAGE}' has no budget. Run with --update to record one.")
+            continue
+
+        budget = budgets[row.STAGE]
+        limit = max(budget["SECONDS"] * (1 + margin), MIN_SECONDS)
+        if row.SECONDS > limit:
+            failures.append(f"Stage '{row.STAGE}' took {row.SECONDS}s (budget {budget['SECONDS']}s + {margin:.0%}).")
+
+        if budget.get("MEMORY_MB") is not None and pd.notna(row.MEMORY_MB):
+            if row.MEMORY_MB > max(budget["MEMORY_MB"] * (1 + margin), budget["MEMORY_MB"] + MIN_MB):
+                failures.append(f"Stage '{row.STAGE}' used {row.MEMORY_MB:.0f} MB (budget {budget['MEMORY_MB']} MB + {margin:.0%}).")
+
+    return failures
+
+def keep_rows(table, field, values):
+
+    import arcpy
+
+    removed = 0
+    with arcpy.da.UpdateCursor(table, [field]) as ucursor:
+        for row in ucursor:
+            if row[0] not in values:
+                ucursor.deleteRow()
+                removed += 1
+
+    print(f"{os.path.basename(table)}: {removed} rows removed.")
+
+def make_fixture(source, fixture, extent):
+
+    # copy the whole source MHN (domains, datasets and relationship classes included),
+    # then cut every table the pipeline reads down to the arcs inside extent and the
+    # nodes, projects, bus lines and park-and-rides that only use those arcs
+    import arcpy
+    import numpy as np
+    import geometry
+    import spatial_grid
+
+    xmin, ymin, xmax, ymax = extent
+    arcpy.management.Copy(source, fixture)
+
+    arcs = os.path.join(fixture, "hwynet", "hwynet_arc")
+    abbs, coords, part_offsets, geom_offsets = geometry.read_geometry(arcs, "ABB")
+
+    inside = (coords[:, 0] >= xmin) & (coords[:, 0] <= xmax) & (coords[:, 1] >= ymin) & (coords[:, 1] <= ymax)
+    point_geom = spatial_grid.point_geoms(coords, part_offsets, geom_offsets)
+    outside = np.bincount(point_geom[~inside], minlength = len(abbs))
+    kept_abbs = set(abbs[(outside == 0) & (np.diff(geom_offsets) > 0)])
+
+    arc_df = pd.DataFrame(data = [row for row in arcpy.da.SearchCursor(arcs, ["ABB", "ANODE", "BNODE"])], columns = ["ABB", "ANODE", "BNODE"])
+    arc_df = arc_df[arc_df.ABB.isin(kept_abbs)]
+    kept_nodes = set(arc_df.ANODE) | set(arc_df.BNODE)
+
+    # projects and bus lines are kept whole or not at all
+    coding = os.path.join(fixture, "hwyproj_coding")
+    coding_df = pd.DataFrame(data = [row for row in arcpy.da.SearchCursor(coding, ["TIPID", "ABB"])], columns = ["TIPID", "ABB"])
+    kept_tipids = set(coding_df.groupby("TIPID")["ABB"].agg(lambda abb: abb.isin(kept_abbs).all()).loc[lambda ok: ok].index)
+
+    kept_lines = {}
+    for x in ["current", "future"]:
+        itin_df = pd.DataFrame(data = [row for row in arcpy.da.SearchCursor(os.path.join(fixture, f"bus_{x}_itin_2024"), ["TRANSIT_LINE", "ABB"])],
+                               columns = ["TRANSIT_LINE", "ABB"])
+        kept_lines[x] = set(itin_df.groupby("TRANSIT_LINE")["ABB"].agg(lambda abb: abb.isin(kept_abbs).all()).loc[lambda ok: ok].index)
+
+    keep_rows(arcs, "ABB", kept_abbs)
+    keep_rows(os.path.join(fixture, "hwynet", "hwynet_node"), "NODE", kept_nodes)
+    keep_rows(coding, "TIPID", kept_tipids)
+    keep_rows(os.path.join(fixture, "hwynet", "hwyproj"), "TIPID", kept_tipids)
+    for x in ["current", "future"]:
+        keep_rows(os.path.join(fixture, "hwynet", f"bus_{x}_2024"), "TRANSIT_LINE", kept_lines[x])
+        keep_rows(os.path.join(fixture, f"bus_{x}_itin_2024"), "TRANSIT_LINE", kept_lines[x])
+    keep_rows(os.path.join(fixture, "parknride"), "NODE", kept_nodes)
+
+    arcpy.management.Compact(fixture)
+
+def run_pipeline(fixture, output_root, cache_path):
+
+    # a fresh cache folder every run, so a warm or evicted repo cache can't move the timings
+    script = os.path.join(repo_path, "scripts", "transform_schema.py")
+    subprocess.run([sys.executable, script, fixture, output_root, cache_path], check = True)
+
+    with open(os.path.join(output_root, "CURRENT"), "r") as f:
+        return os.path.join(output_root, "builds", f.read().strip())
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Run the pipeline on the fixture MHN and compare with the golden output.")
+    parser.add_argument("--fixture", default = default_fixture, help = "fixture MHN_old.gdb")
+    parser.add_argument("--golden", default = default_golden, help = "folder with snapshot.json and budgets.json")
+    parser.add_argument("--margin", type = float, default = 0.25, help = "allowed time/memory overrun (0.25 = 25%%)")
+    parser.add_argument("--update", action = "store_true", help = "record the current output and timings as golden")
+    parser.add_argument("--keep", action = "store_true", help = "keep the temporary output folder")
+    parser.add_argument("--make-fixture", metavar = "SOURCE_GDB", help = "cut a new fixture out of a full MHN_old.gdb")
+    parser.add_argument("--extent", help = "\"xmin ymin xmax ymax\" of the fixture area, in the MHN's coordinates")
+    args = parser.parse_args()
+
+    if args.make_fixture:
+        if not args.extent:
+            parser.error("--make-fixture needs --extent")
+        if os.path.exists(args.fixture):
+            sys.exit(f"{args.fixture} already exists. Remove it first.")
+        os.makedirs(os.path.dirname(args.fixture), exist_ok = True)
+        make_fixture(args.make_fixture, args.fixture, [float(v) for v in args.extent.split()])
+        print(f"Fixture written to {args.fixture}. Run with --update to record its golden snapshot.")
+        sys.exit(0)
+
+    if not os.path.isdir(args.fixture):
+        sys.exit(f"No fixture at {args.fixture}. Make one with --make-fixture.")
+
+    if not args.update and not os.path.exists(os.path.join(args.golden, "snapshot.json")):
+        sys.exit(f"No golden snapshot in {args.golden}. Record one with --update.")
+
+    work_path = tempfile.mkdtemp(prefix = "mhn_regression_")
+    output_root = os.path.join(work_path, "output")
+
+    try:
+        build_path = run_pipeline(args.fixture, output_root, os.path.join(work_path, "cache"))
+        current = snapshot(build_path)
+        stage_df = pd.read_csv(os.path.join(build_path, "stage_times.csv"))
+
+        snapshot_file = os.path.join(args.golden, "snapshot.json")
+        budgets_file = os.path.join(args.golden, "budgets.json")
+
+        if args.update:
+            os.makedirs(args.golden, exist_ok = True)
+            with open(snapshot_file, "w") as f:
+                json.dump(current, f, indent = 1)
+            budgets = {row.STAGE: {"SECONDS": row.SECONDS, "MEMORY_MB": None if pd.isna(row.MEMORY_MB) else int(row.MEMORY_MB)}
+                       for row in stage_df.itertuples(index = False)}
+            with open(budgets_file, "w") as f:
+                json.dump(budgets, f, indent = 2)
+            print(f"Recorded golden snapshot and budgets in {args.golden}.")
+            sys.exit(0)
+
+        with open(snapshot_file, "r") as f:
+            golden = json.load(f)
+        with open(budgets_file, "r") as f:
+            budgets = json.load(f)
+
+        failures = compare_snapshots(golden, current) + compare_budgets(budgets, stage_df, args.margin)
+
+    finally:
+        if args.keep:
+            print(f"Output kept in {output_root}.")
+        else:
+            shutil.rmtree(work_path, ignore_errors = True)
+
+    if failures:
+        for failure in failures:
+            print("FAIL: " + failure)
+        sys.exit(f"{len(failures)} regression checks failed.")
+
+    print("Output matches the golden snapshot and all stages are within budget.")
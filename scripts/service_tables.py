@@ -0,0 +1,68 @@
+
+import numpy as np
+import pandas as pd
+
+# Transit service frequency tables derived from the bus layers with group-bys:
+#   route_hour   trips and effective headway per route, direction and start hour
+#   route_tod    trips and effective headway per route (or line) and TOD period
+#   link_tod     trips and buses per hour on each ABB per TOD period
+
+# CMAP time-of-day periods: TOD -> (first hour, hours long). period 1 wraps past midnight.
+TOD_PERIODS = {1: (20, 10), 2: (6, 1), 3: (7, 2), 4: (9, 1), 5: (10, 4), 6: (14, 2), 7: (16, 2), 8: (18, 2)}
+
+HOUR_TOD = np.zeros(24, dtype = np.int64)
+for tod, (first_hour, hours) in TOD_PERIODS.items():
+    HOUR_TOD[(first_hour + np.arange(hours)) % 24] = tod
+
+TOD_MINUTES = pd.Series({tod: hours * 60 for tod, (first_hour, hours) in TOD_PERIODS.items()})
+
+def current_route_tables(lines_df):
+
+    # lines_df: TRANSIT_LINE, ROUTE_ID, DIRECTION, STARTHOUR; every line is one run.
+    # link frequency only needs the start hour, so lines without a ROUTE_ID still count there
+    df = lines_df.dropna(subset = ["STARTHOUR"]).copy()
+    df["HOUR"] = df["STARTHOUR"].astype(np.int64) % 24
+    df["TOD"] = HOUR_TOD[df["HOUR"].to_numpy()]
+    df["DIRECTION"] = df["DIRECTION"].fillna("")
+
+    line_trips = df[["TRANSIT_LINE", "TOD"]].assign(TRIPS = 1.0)
+
+    routes = df.dropna(subset = ["ROUTE_ID"])
+
+    route_hour = routes.groupby(["ROUTE_ID", "DIRECTION", "HOUR"]).size().reset_index(name = "TRIPS")
+    route_hour["HEADWAY"] = 60 / route_hour["TRIPS"]
+
+    route_tod = routes.groupby(["ROUTE_ID", "DIRECTION", "TOD"]).size().reset_index(name = "TRIPS")
+    route_tod["HEADWAY"] = route_tod["TOD"].map(TOD_MINUTES) / route_tod["TRIPS"]
+
+    return route_hour, route_tod, line_trips
+
+def future_route_tables(lines_df):
+
+    # lines_df: TRANSIT_LINE, HEADWAY, TOD. TOD lists the periods a line runs in
+    # ("37" = periods 3 and 7); "0" or blank means all day. trips = period / headway.
+    # these are the future lines' own service only: REPLACE / REROUTE (which existing
+    # routes a line takes over) are not applied, since that depends on the scenario run
+    df = lines_df[lines_df["HEADWAY"].fillna(0) > 0].copy()
+
+    tods = df["TOD"].fillna("0").astype(str).str.strip().replace({"": "0"})
+    tods = tods.where(tods != "0", "".join(str(tod) for tod in TOD_PERIODS))
+    df["TOD"] = tods.map(lambda t: sorted(set(int(c) for c in t if c.isdigit() and int(c) in TOD_PERIODS)))
+
+    df = df.explode("TOD").dropna(subset = ["TOD"])
+    df["TOD"] = df["TOD"].astype(np.int64)
+    df["TRIPS"] = df["TOD"].map(TOD_MINUTES) / df["HEADWAY"]
+
+    route_tod = df[["TRANSIT_LINE", "TOD", "TRIPS", "HEADWAY"]].reset_index(drop = True)
+
+    return route_tod, df[["TRANSIT_LINE", "TOD", "TRIPS"]]
+
+def link_table(itin_df, line_trips):
+
+    # itin_df: TRANSIT_LINE, ABB. a line counts once per ABB even if it loops back over it
+    df = itin_df[["TRANSIT_LINE", "ABB"]].drop_duplicates().merge(line_trips, on = "TRANSIT_LINE")
+
+    link_tod = df.groupby(["ABB", "TOD"])["TRIPS"].sum().reset_index()
+    link_tod["BUSES_PER_HOUR"] = link_tod["TRIPS"] / (link_tod["TOD"].map(TOD_MINUTES) / 60)
+
+    return link_tod
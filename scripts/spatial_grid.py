@@ -0,0 +1,161 @@
+
+import numpy as np
+import pandas as pd
+
+import geometry
+
+# Uniform grid index over polyline segments, built and queried with array
+# operations only. Each segment is registered in every cell its bounding box
+# (grown by the search tolerance) touches, so a point only has to look in its
+# own cell to find every segment within tolerance.
+
+class SegmentGrid:
+
+    def __init__(self, seg_a, seg_b, cell_size, pad = 0):
+
+        self.seg_a = seg_a
+        self.seg_b = seg_b
+        self.cell_size = cell_size
+
+        lo = np.minimum(seg_a, seg_b) - pad
+        hi = np.maximum(seg_a, seg_b) + pad
+        self.origin = lo.min(axis = 0) if len(lo) > 0 else np.zeros(2)
+
+        c0 = self.cell(lo)
+        c1 = self.cell(hi)
+        self.n_rows = int(c1[:, 1].max()) + 2 if len(c1) > 0 else 1
+
+        # expand every segment into the cells of its box
+        nx = c1[:, 0] - c0[:, 0] + 1
+        ny = c1[:, 1] - c0[:, 1] + 1
+        counts = nx * ny
+        seg = np.repeat(np.arange(len(seg_a)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        ix = c0[seg, 0] + k // ny[seg]
+        iy = c0[seg, 1] + k % ny[seg]
+
+        keys = self.key(ix, iy)
+        order = np.argsort(keys, kind = "stable")
+        self.keys = keys[order]
+        self.segs = seg[order]
+
+    def cell(self, points):
+
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def key(self, ix, iy):
+
+        return ix * self.n_rows + iy
+
+    def candidates(self, points):
+
+        # (point index, segment index) for every segment sharing the point's cell
+        c = self.cell(points)
+        inside = (c >= 0).all(axis = 1) & (c[:, 1] < self.n_rows)
+        keys = np.where(inside, self.key(c[:, 0], c[:, 1]), -1)
+
+        left = np.searchsorted(self.keys, keys, side = "left")
+        right = np.searchsorted(self.keys, keys, side = "right")
+        counts = np.where(inside, right - left, 0)
+
+        point = np.repeat(np.arange(len(points)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        return point, self.segs[np.repeat(left, counts) + offset]
+
+    def near(self, points, tolerance):
+
+        # (point index, segment index) for every segment within tolerance of the point
+        point, seg = self.candidates(points)
+        d = point_segment_distance(points[point], self.seg_a[seg], self.seg_b[seg])
+        keep = d <= tolerance
+
+        return point[keep], seg[keep]
+
+def point_segment_distance(p, a, b):
+
+    ab = b - a
+    length2 = (ab ** 2).sum(axis = 1)
+    t = np.where(length2 > 0, ((p - a) * ab).sum(axis = 1) / np.where(length2 > 0, length2, 1), 0)
+    t = np.clip(t, 0, 1)
+
+    return np.hypot(*(p - (a + t[:, None] * ab)).T)
+
+def point_geoms(coords, part_offsets, geom_offsets):
+
+    # geometry index of every point
+    return np.repeat(np.repeat(np.arange(len(geom_offsets) - 1), np.diff(geom_offsets)), np.diff(part_offsets))
+
+def pair_distances(pairs, keys1, geom1, keys2, geom2, max_distance):
+
+    # smallest distance between any geometry with KEY1 and any with KEY2 for each row of
+    # pairs (KEY1, KEY2), NaN where that is more than max_distance. taken from the vertices
+    # of each side to the segments of the other, which is exact unless the two lines cross
+    # with no vertex of either within max_distance of the crossing.
+    keys1 = np.asarray(keys1)
+    keys2 = np.asarray(keys2)
+    use1 = np.isin(keys1, pairs["KEY1"])
+    use2 = np.isin(keys2, pairs["KEY2"])
+
+    hits = []
+    for point_keys, point_geom, point_use, seg_keys, seg_geom, seg_use, swap in [
+            [keys1, geom1, use1, keys2, geom2, use2, False],
+            [keys2, geom2, use2, keys1, geom1, use1, True]]:
+
+        owner = point_geoms(*point_geom)
+        keep = point_use[owner]
+        points = point_geom[0][keep]
+        owner = owner[keep]
+
+        a, b, seg_owner = geometry.segments(*seg_geom)
+        keep = seg_use[seg_owner]
+        a, b, seg_owner = a[keep], b[keep], seg_owner[keep]
+
+        if len(points) == 0 or len(a) == 0:
+            continue
+
+        cell_size = max(float(np.median(np.hypot(*(b - a).T))), max_distance, 1.0)
+        grid = SegmentGrid(a, b, cell_size, pad = max_distance)
+        point, seg = grid.near(points, max_distance)
+
+        key_a = point_keys[owner[point]]
+        key_b = seg_keys[seg_owner[seg]]
+        hits.append(pd.DataFrame({
+            "KEY1": key_b if swap else key_a,
+            "KEY2": key_a if swap else key_b,
+            "DISTANCE": point_segment_distance(points[point], a[seg], b[seg])
+        }))
+
+    if len(hits) == 0:
+        return np.full(len(pairs), np.nan)
+
+    nearest = pd.concat(hits).groupby(["KEY1", "KEY2"], as_index = False)["DISTANCE"].min()
+
+    return pairs[["KEY1", "KEY2"]].merge(nearest, how = "left", on = ["KEY1", "KEY2"])["DISTANCE"].to_numpy()
+
+def match_lines(arc_keys, arc_geom, line_keys, line_geom, tolerance, min_hits = 2, cell_size = None):
+
+    # arcs each line runs along: pairs where at least min_hits of the line's vertices lie
+    # within tolerance of the arc. *_geom are (coords, part_offsets, geom_offsets).
+    arc_a, arc_b, arc_seg_geom = geometry.segments(*arc_geom)
+
+    if cell_size is None:
+        seg_length = np.hypot(*(arc_b - arc_a).T)
+        cell_size = max(float(np.median(seg_length)) if len(seg_length) > 0 else 1.0, 4 * tolerance, 1.0)
+
+    grid = SegmentGrid(arc_a, arc_b, cell_size, pad = tolerance)
+
+    coords = line_geom[0]
+    point_line = point_geoms(*line_geom)
+
+    point, seg = grid.near(coords, tolerance)
+
+    hits = pd.DataFrame({"line": point_line[point], "point": point, "arc": arc_seg_geom[seg]}).drop_duplicates()
+    hits = hits.groupby(["line", "arc"]).size().reset_index(name = "HITS")
+    hits = hits[hits.HITS >= min_hits]
+
+    return pd.DataFrame({
+        "LINE": np.asarray(line_keys)[hits["line"].to_numpy()],
+        "ARC": np.asarray(arc_keys)[hits["arc"].to_numpy()],
+        "HITS": hits["HITS"].to_numpy()
+    })
@@ -0,0 +1,229 @@
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Low-memory storage for the big intermediate link tables. Each column is saved
+# as its own .npy file on local disk and opened memory-mapped, so only the pages
+# a lookup touches are pulled into RAM. Rows are sorted by key inside each part
+# so lookups are a binary search instead of a dict.
+
+def make_spill_dir(parent = None):
+
+    return tempfile.mkdtemp(prefix = "mhn_spill_", dir = parent)
+
+def remove_spill_dir(path):
+
+    shutil.rmtree(path, ignore_errors = True)
+
+def key_text(value):
+
+    # 123 and 123.0 must give the same key; a null in a chunk turns an int column to float
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+
+    return str(value)
+
+def encode_key(key):
+
+    # multi-field keys (e.g. ANODE, BNODE) are stored as one string
+    if isinstance(key, tuple):
+        return "|".join(key_text(k) for k in key)
+
+    return key
+
+def key_column(values):
+
+    # text form of one field of a multi-field key, matching key_text
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        not_null = values.dropna()
+        if (not_null == np.floor(not_null)).all():
+            values = values.astype("Int64")
+
+    return values.astype(object).map(lambda v: "<NA>" if pd.isna(v) else key_text(v))
+
+def check_unique(keys, path):
+
+    # to_dict("index") refuses duplicate keys, so the spilled table does too
+    keys = np.sort(keys, kind = "stable")
+    dup = np.flatnonzero(keys[1:] == keys[:-1])
+    if len(dup) > 0:
+        raise ValueError(f"Duplicate key {keys[dup[0]]} in spilled table {path}.")
+
+def column_to_array(values):
+
+    # returns (array, null mask or None) in a form np.save can memory-map
+    if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return values.to_numpy(), None
+
+    values = values.astype(object)
+    nulls = values.isna().to_numpy()
+    not_null = values[~nulls]
+
+    if not_null.map(lambda v: isinstance(v, str)).all():
+        width = max(int(not_null.str.len().max()) if len(not_null) > 0 else 1, 1)
+        array = np.asarray(values.where(~nulls, "").astype(str), dtype = f"U{width}")
+        return array, (nulls if nulls.any() else None)
+
+    return pd.to_numeric(values).to_numpy(), None
+
+def save_part(df, path, key):
+
+    os.makedirs(path)
+
+    key_fields = [key] if isinstance(key, str) else list(key)
+
+    if len(key_fields) == 1:
+        keys, _ = column_to_array(df[key_fields[0]])
+    else:
+        key_df = pd.DataFrame({field: key_column(df[field]) for field in key_fields})
+        keys = np.asarray(key_df.agg("|".join, axis = 1) if len(key_df) > 0 else [], dtype = str)
+
+    order = np.argsort(keys, kind = "stable")
+    check_unique(keys[order], path)
+    np.save(os.path.join(path, "__key__.npy"), keys[order])
+
+    for field in df.columns:
+        array, nulls = column_to_array(df[field])
+        np.save(os.path.join(path, f"{field}.npy"), array[order])
+        if nulls is not None:
+            np.save(os.path.join(path, f"__null__{field}.npy"), nulls[order])
+
+class SpilledPart:
+
+    def __init__(self, path, columns):
+
+        self.keys = np.load(os.path.join(path, "__key__.npy"), mmap_mode = "r")
+        self.data = {}
+        self.nulls = {}
+
+        for field in columns:
+            self.data[field] = np.load(os.path.join(path, f"{field}.npy"), mmap_mode = "r")
+            null_file = os.path.join(path, f"__null__{field}.npy")
+            if os.path.exists(null_file):
+                self.nulls[field] = np.load(null_file, mmap_mode = "r")
+
+    def find(self, key):
+
+        i = np.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return int(i)
+
+        return -1
+
+    def value(self, field, i):
+
+        if field in self.nulls and self.nulls[field][i]:
+            return None
+
+        value = self.data[field][i]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def column(self, field):
+
+        values = pd.Series(np.asarray(self.data[field]))
+        if field in self.nulls:
+            values = values.astype(object).where(~np.asarray(self.nulls[field]), None)
+
+        return values
+
+class SpilledTable:
+
+    # drop-in for df.set_index(key).to_dict("index"): table[key] returns a dict
+    # of the non-key fields, and `key in table` works the same way.
+
+    def __init__(self, path, columns, key, parts):
+
+        self.path = path
+        self.columns = columns
+        self.key_fields = [key] if isinstance(key, str) else list(key)
+        self.parts = [SpilledPart(part, columns) for part in parts]
+
+        if len(self.parts) > 1:
+            check_unique(np.concatenate([np.asarray(part.keys) for part in self.parts]), path)
+
+    def locate(self, key):
+
+        key = encode_key(key)
+        for part in self.parts:
+            i = part.find(key)
+            if i >= 0:
+                return part, i
+
+        return None, -1
+
+    def __contains__(self, key):
+
+        return self.locate(key)[0] is not None
+
+    def __getitem__(self, key):
+
+        part, i = self.locate(key)
+        if part is None:
+            raise KeyError(key)
+
+        return {field: part.value(field, i) for field in self.columns if field not in self.key_fields}
+
+    def __len__(self):
+
+        return sum(len(part.keys) for part in self.parts)
+
+    def frame(self, fields = None):
+
+        fields = self.columns if fields is None else fields
+        frames = [pd.DataFrame({field: part.column(field) for field in fields}) for part in self.parts]
+
+        if len(frames) == 0:
+            return pd.DataFrame(columns = fields)
+
+        return pd.concat(frames, ignore_index = True)
+
+    def select(self, field, values):
+
+        # rows where field is in values, reading only the matching rows
+        frames = []
+        for part in self.parts:
+            mask = pd.Series(np.asarray(part.data[field])).isin(values).to_numpy()
+            rows = np.flatnonzero(mask)
+            frames.append(pd.DataFrame({f: part.column(f).iloc[rows].reset_index(drop = True) for f in self.columns}))
+
+        if len(frames) == 0:
+            return pd.DataFrame(columns = self.columns)
+
+        return pd.concat(frames, ignore_index = True)
+
+    def close(self):
+
+        # memory-mapped files must be released before the folder can be removed on Windows
+        self.parts = []
+
+def spill_frame(df, path, key):
+
+    columns = list(df.columns)
+    part = os.path.join(path, "part0")
+    save_part(df, part, key)
+
+    return SpilledTable(path, columns, key, [part])
+
+def spill_rows(rows, columns, path, key, chunk_size = 250000):
+
+    # consume a cursor chunk by chunk so the whole table never sits in RAM at once
+    parts = []
+    chunk = []
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            part = os.path.join(path, f"part{len(parts)}")
+            save_part(pd.DataFrame(data = chunk, columns = columns), part, key)
+            parts.append(part)
+            chunk = []
+
+    if len(chunk) > 0 or len(parts) == 0:
+        part = os.path.join(path, f"part{len(parts)}")
+        save_part(pd.DataFrame(data = chunk, columns = columns), part, key)
+        parts.append(part)
+
+    return SpilledTable(path, columns, key, parts)
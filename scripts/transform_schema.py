@@ -1,13 +1,23 @@
 
 import os
 import sys
-import shutil
 import arcpy
 import numpy as np
 import pandas as pd
 import csv
 import math
 import time
+import threading
+
+import spill
+import extract_cache
+import publish
+import emme_export
+import itin_store
+import geometry
+import spatial_grid
+import service_tables
+import bus_routes
 
 pd.options.mode.chained_assignment = None  # default='warn'
 
@@ -17,16 +27,58 @@ sys_path = sys.argv[0]
 abs_path = os.path.abspath(sys_path)
 repo_path = os.path.dirname(os.path.dirname(abs_path))
 
+# usage: python transform_schema.py [input gdb] [output folder] [cache folder]
+# (all optional; regression.py uses them to run on a fixture with an empty cache)
+
 # path to input folder
 input_path = os.path.join(repo_path, "input")
-input_mhn = os.path.join(input_path, "MHN_old.gdb")
-# path to output folder
-output_path = os.path.join(repo_path, "output")
+input_mhn = sys.argv[1] if len(sys.argv) > 1 else os.path.join(input_path, "MHN_old.gdb")
+# path to output folder. each run builds into output/staging and is published to
+# output/builds, with output/current pointing at the latest good build
+output_root = sys.argv[2] if len(sys.argv) > 2 else os.path.join(repo_path, "output")
 
 # path to domain folder
 domains = os.path.join(repo_path, "input", "mhn_domains")
 # path to schema folder
 schema = os.path.join(repo_path, "input", "mhn_schema")
+# path to index list
+indexes = os.path.join(repo_path, "input", "mhn_indexes.csv")
+
+# SETTINGS ----------------------------------------------------------------------------------------
+
+# keep the large link tables in memory-mapped files on local disk instead of in RAM.
+# slower, but lets the pipeline run on small machines or much larger networks.
+low_memory = False
+# folder for the memory-mapped files (None = system temp folder)
+spill_parent = None
+
+# cache of the source tables read from MHN_old.gdb, reused while the source is unchanged
+# (needs pyarrow). use extract_cache.py to list or evict entries. None = always read through arcpy.
+cache_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(repo_path, "cache")
+
+# number of published builds to keep in output/builds for rollback (see publish.py)
+keep_builds = 3
+
+# write Emme batch-in files (network.d211, transit_x.d221) into the build's emme folder
+export_emme = True
+
+# store bus_current_itin as unique paths plus a line -> path map (bus_current_itin_path/_line)
+# instead of the full table. the bus_current relationship classes then use those two tables
+dedup_itineraries = False
+
+# recompute MILES and BEARING from the arc geometry and report links that differ by more than
+# miles_tolerance (or have a different bearing). repair_geometry_attributes writes the new values.
+miles_tolerance = 0.005
+repair_geometry_attributes = False
+
+# match hwyproj geometry to the arcs it runs along (within hwyproj_tolerance feet) and report
+# coding rows whose ABB is more than hwyproj_far_distance feet from the project
+check_hwyproj_geometry = True
+hwyproj_tolerance = 50
+hwyproj_far_distance = 2640
+
+# add trip and headway tables by route / hour / TOD period and bus trips per link (bus_x_route_tod etc.)
+build_service_tables = True
 
 def made_code_dict(name):
     code_dict = {}
@@ -39,12 +91,103 @@ def made_code_dict(name):
 
     return code_dict
 
-# MAKE GDB ----------------------------------------------------------------------------------------
+# time and memory of each stage, written to stage_times.csv for regression.py.
+# MEMORY_MB is how far resident memory rose above its level at the start of the
+# stage, sampled in the background so each stage gets its own peak.
+stage_times = []
+stage_memory = {"start": None, "peak": None}
+
+def memory_mb():
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+
+    return psutil.Process().memory_info().rss / 1024 / 1024
+
+def sample_memory():
+
+    while True:
+        mb = memory_mb()
+        if stage_memory["peak"] is not None and mb > stage_memory["peak"]:
+            stage_memory["peak"] = mb
+        time.sleep(0.05)
+
+def end_stage():
+
+    if stage_times and "SECONDS" not in stage_times[-1]:
+        stage = stage_times[-1]
+        stage["SECONDS"] = round(time.time() - stage.pop("START"), 2)
+        if stage_memory["start"] is not None:
+            stage["MEMORY_MB"] = round(max(stage_memory["peak"], memory_mb()) - stage_memory["start"])
+
+def start_stage(label):
+
+    end_stage()
+
+    mb = memory_mb()
+    if mb is not None and stage_memory["start"] is None:
+        threading.Thread(target = sample_memory, daemon = True).start()
+    stage_memory["start"] = mb
+    stage_memory["peak"] = mb
 
-if os.path.isdir(output_path) == True:
-    shutil.rmtree(output_path)
+    stage_times.append({"STAGE": label, "START": time.time()})
+    print(label)
+
+def write_table(name, df):
+
+    # create a table from its schema csv and fill it from a DataFrame with the same field names
+    arcpy.management.CreateTable(output_GDB, name)
+
+    schema_df = pd.read_csv(os.path.join(schema, f"{name}.csv"))
+    schema_df = schema_df.replace(np.nan, None)
+
+    schema_list = [[row["NAME"], 
+                    row["TYPE"], 
+                    row["ALIAS"], 
+                    row["LENGTH"], 
+                    row["DEFAULT"], 
+                    row["DOMAIN"]] 
+                   for index, row in schema_df.iterrows()]
+
+    arcpy.management.AddFields(name,
+                               schema_list)
+
+    fields = schema_df["NAME"].tolist()
+    df = df[fields]
+
+    with arcpy.da.InsertCursor(name, fields) as icursor:
+
+        for row in df.astype(object).where(df.notna(), None).itertuples(index = False, name = None):
+            icursor.insertRow(row)
+
+def add_indexes(tables):
+
+    # attribute indexes are listed in mhn_indexes.csv; feature classes also get a spatial index.
+    # only call this once a table is loaded so the inserts don't have to maintain the indexes.
+    index_df = pd.read_csv(indexes, dtype = str)
+
+    for table in tables:
+
+        schema_fields = pd.read_csv(os.path.join(schema, f"{table}.csv"))["NAME"].tolist()
+
+        for fields in index_df[index_df.TABLE == table]["FIELDS"]:
+
+            field_list = fields.split(";")
+            missing = [field for field in field_list if field not in schema_fields]
+            if missing:
+                raise ValueError(f"Index on {table} uses fields not in its schema: {', '.join(missing)}")
+
+            arcpy.management.AddIndex(table, field_list, "IX_" + "_".join(field_list))
+
+        if arcpy.Describe(table).dataType == "FeatureClass":
+            arcpy.management.AddSpatialIndex(table)
+
+# MAKE GDB ----------------------------------------------------------------------------------------
 
-os.mkdir(output_path)
+# build into a staging folder so the published output stays readable during the run
+output_path = publish.new_build(output_root)
 
 # make output gdb
 arcpy.management.CreateFileGDB(output_path, "MHN_new.gdb")
@@ -55,7 +198,7 @@ arcpy.management.CreateFeatureDataset(output_GDB, "hwynet", 26771)
 
 # ADD NODE DOMAINS --------------------------------------------------------------------------------
 
-print("Adding node domains...")
+start_stage("Adding node domains...")
 
 name = "BINARY"
 description = "0 or 1"
@@ -92,7 +235,7 @@ for code in code_dict:
 
 # ADD NODE FC -------------------------------------------------------------------------------------
 
-print("Creating node feature class...")
+start_stage("Creating node feature class...")
 
 workspace = os.path.join(output_GDB, "hwynet")
 name = "hwynet_node"
@@ -113,17 +256,16 @@ arcpy.management.AddFields(name,
                            schema_list)
 
 input_nodes = os.path.join(input_mhn, "hwynet", name)
-fields = ["SHAPE@XY", "NODE", "POINT_X", "POINT_Y", "subzone17", "zone17", "capzone17", "IMAREA"]
+fields = ["SHAPE@WKB", "NODE", "POINT_X", "POINT_Y", "subzone17", "zone17", "capzone17", "IMAREA"]
 
-with arcpy.da.SearchCursor(input_nodes, fields) as scursor:
-    with arcpy.da.InsertCursor(name, fields) as icursor:
+with arcpy.da.InsertCursor(name, fields) as icursor:
 
-        for row in scursor:
-            icursor.insertRow(row)
+    for row in extract_cache.read_rows(input_nodes, fields, cache_path = cache_path):
+        icursor.insertRow(row)
 
 # ADD LINK DOMAINS --------------------------------------------------------------------------------
 
-print("Adding link domains...")
+start_stage("Adding link domains...")
 
 name = "BASELINK"
 description = "Skeleton or regular"
@@ -200,7 +342,7 @@ arcpy.management.SetValueForRangeDomain(output_GDB, name, -1, 999)
 
 # ADD LINK FC -------------------------------------------------------------------------------------
 
-print("Creating link feature class...")
+start_stage("Creating link feature class...")
 
 workspace = os.path.join(output_GDB, "hwynet")
 name = "hwynet_arc"
@@ -230,11 +372,19 @@ for field in schema_list:
 
 input_links = os.path.join(input_mhn, "hwynet", name)
 input_links_fields = [f.name for f in arcpy.ListFields(input_links) if (f.type!="Geometry" and f.name != "OBJECTID")]
-input_links_df = pd.DataFrame(
-            data = [row for row in arcpy.da.SearchCursor(input_links, input_links_fields)], 
-            columns = input_links_fields)
 
-link_dict = input_links_df.set_index("ABB").to_dict("index")
+if low_memory:
+    spill_path = spill.make_spill_dir(spill_parent)
+
+    scursor = extract_cache.read_rows(input_links, input_links_fields, cache_path = cache_path)
+    link_dict = spill.spill_rows(scursor, input_links_fields, os.path.join(spill_path, "input_links"), "ABB")
+
+    input_links_df = link_dict.frame(["ABB", "MODES", "TRUCKRES", "BASELINK", "VCLEARANCE"])
+
+else:
+    input_links_df = extract_cache.read_table(input_links, input_links_fields, cache_path = cache_path)
+
+    link_dict = input_links_df.set_index("ABB").to_dict("index")
 
 # save for later 
 truckres_df = input_links_df[(input_links_df.MODES != "2") & (input_links_df.TRUCKRES != "0")][["ABB", "TRUCKRES"]]
@@ -242,18 +392,19 @@ truckres_dict = truckres_df.set_index("ABB")["TRUCKRES"].to_dict()
 vclearance_df = input_links_df[(input_links_df.BASELINK == "0") & (input_links_df.VCLEARANCE != 0)][["ABB", "VCLEARANCE"]]
 vclearance_dict = vclearance_df.set_index("ABB")["VCLEARANCE"].to_dict()
 
-fields = ["SHAPE@", "ANODE", "BNODE", "BASELINK", "ABB",
+del input_links_df, truckres_df, vclearance_df
+
+fields = ["SHAPE@WKB", "ANODE", "BNODE", "BASELINK", "ABB",
           "ROADNAME", "DIRECTIONS", "TYPE1", "TYPE2", "AMPM1", "AMPM2",
           "POSTEDSPEED1", "POSTEDSPEED2", "THRULANES1", "THRULANES2",
           "THRULANEWIDTH1", "THRULANEWIDTH2", "PARKLANES1", "PARKLANES2",
           "SIGIC", "RRGRADECROSS", "VCLEARANCE", "NHSIC",
           "CHIBLVD", "TOLLSYS", "TRUCKRTE", "MESO", "MILES", "BEARING"]
 
-with arcpy.da.SearchCursor(input_links, fields) as scursor:
-    with arcpy.da.InsertCursor(name, fields) as icursor:
+with arcpy.da.InsertCursor(name, fields) as icursor:
 
-        for row in scursor:
-            icursor.insertRow(row)
+    for row in extract_cache.read_rows(input_links, fields, cache_path = cache_path):
+        icursor.insertRow(row)
 
 fields = ["ABB", "PARKRES1", "PARKRES2", "CLTL", "TOLLDOLLARS", "MODES", "SRA"]
 with arcpy.da.UpdateCursor(name, fields) as ucursor:
@@ -295,9 +446,49 @@ with arcpy.da.UpdateCursor(name, fields) as ucursor:
 
         ucursor.updateRow(row)
 
+# CHECK MILES AND BEARING
+# the whole network in one pass over the coordinate arrays (EPSG:26771 is in US survey feet)
+geom_df = extract_cache.read_table(input_links, ["ABB", "MILES", "BEARING", "SHAPE@WKB"], cache_path = cache_path)
+coords, part_offsets, geom_offsets = geometry.wkb_to_arrays(geom_df["SHAPE@WKB"])
+first, last = geometry.geometry_endpoints(coords, part_offsets, geom_offsets)
+
+geom_df["NEW_MILES"] = geometry.polyline_lengths(coords, part_offsets, geom_offsets) / 5280
+geom_df["NEW_BEARING"] = geometry.bearing_classes(first, last)
+
+# arcs with null or empty geometry have nothing to recompute from. they are listed
+# in the report with NO_GEOMETRY = 1 and never repaired
+geom_df["NO_GEOMETRY"] = np.isnan(first[:, 0]).astype(int)
+geom_df.loc[geom_df.NO_GEOMETRY == 1, ["NEW_MILES", "NEW_BEARING"]] = None
+
+mismatch_df = geom_df[(geom_df.NO_GEOMETRY == 0) & 
+                      (((geom_df.NEW_MILES - geom_df.MILES).abs() > miles_tolerance) | 
+                       (geom_df.NEW_BEARING != geom_df.BEARING))]
+no_geometry_df = geom_df[geom_df.NO_GEOMETRY == 1]
+
+report_fields = ["ABB", "MILES", "NEW_MILES", "BEARING", "NEW_BEARING", "NO_GEOMETRY"]
+pd.concat([mismatch_df[report_fields], no_geometry_df[report_fields]]).to_csv(os.path.join(output_path, "geometry_mismatches.csv"), index = False)
+
+print(f"{len(mismatch_df)} links have MILES or BEARING that do not match their geometry. Check csv.")
+if len(no_geometry_df) > 0:
+    print(f"{len(no_geometry_df)} links have no geometry. Check csv.")
+
+if repair_geometry_attributes and len(mismatch_df) > 0:
+
+    repair_dict = mismatch_df.set_index("ABB")[["NEW_MILES", "NEW_BEARING"]].to_dict("index")
+
+    with arcpy.da.UpdateCursor(name, ["ABB", "MILES", "BEARING"]) as ucursor:
+        for row in ucursor:
+
+            if row[0] in repair_dict:
+                row[1] = round(repair_dict[row[0]]["NEW_MILES"], 4)
+                row[2] = repair_dict[row[0]]["NEW_BEARING"]
+                ucursor.updateRow(row)
+
+del geom_df, mismatch_df, no_geometry_df, coords, part_offsets, geom_offsets, first, last
+
 # ADD HWYPROJ FC ----------------------------------------------------------------------------------
 
-print("Creating hwyproj feature class...")
+start_stage("Creating hwyproj feature class...")
 
 workspace = os.path.join(output_GDB, "hwynet")
 name = "hwyproj"
@@ -322,23 +513,22 @@ for field_name in ["TIPID", "COMPLETION_YEAR"]:
     arcpy.management.AlterField(name, field_name, field_is_nullable = "NON_NULLABLE")
 
 input_proj = os.path.join(input_mhn, "hwynet", name)
-fields = ["SHAPE@", "TIPID", "COMPLETION_YEAR", "MCP_ID", "RSP_ID", "RCP_ID", "NOTES"]
+fields = ["SHAPE@WKB", "TIPID", "COMPLETION_YEAR", "MCP_ID", "RSP_ID", "RCP_ID", "NOTES"]
 
-with arcpy.da.SearchCursor(input_proj, fields) as scursor:
-    with arcpy.da.InsertCursor(name, fields) as icursor:
+with arcpy.da.InsertCursor(name, fields) as icursor:
 
-        for row in scursor:
+    for row in extract_cache.read_rows(input_proj, fields, cache_path = cache_path):
 
-            tipid = row[1]
-            leading0 = "0" * (8- len(tipid))
-            tipid8 = leading0 + tipid
-            tipid10 = f"{tipid8[:2]}-{tipid8[2:4]}-{tipid8[4:]}"
+        tipid = row[1]
+        leading0 = "0" * (8- len(tipid))
+        tipid8 = leading0 + tipid
+        tipid10 = f"{tipid8[:2]}-{tipid8[2:4]}-{tipid8[4:]}"
 
-            icursor.insertRow([row[0], tipid10, row[2], row[3], row[4], row[5], row[6]])
+        icursor.insertRow([row[0], tipid10, row[2], row[3], row[4], row[5], row[6]])
 
 # ADD HWYPROJ CODING DOMAINS ----------------------------------------------------------------------
 
-print("Adding hwyproj coding domains...")
+start_stage("Adding hwyproj coding domains...")
 
 name = "ACTION"
 description = "Highway project action code"
@@ -356,7 +546,7 @@ for code in code_dict:
 
 # ADD HWYPROJ CODING TABLE ------------------------------------------------------------------------
 
-print("Creating hwyproj coding table...")
+start_stage("Creating hwyproj coding table...")
 
 name = "hwyproj_coding"
 arcpy.management.CreateTable(output_GDB, name)
@@ -394,33 +584,32 @@ i_fields = ["TIPID", "ABB", "ACTION_CODE", "NEW_DIRECTIONS", # 0-3
             "NEW_THRULANEWIDTH1", "NEW_THRULANEWIDTH2", "ADD_PARKLANES1", "ADD_PARKLANES2", # 12-15
             "ADD_SIGIC", "ADD_CLTL", "ADD_RRGRADECROSS", "NEW_TOLLDOLLARS", "NEW_MODES"] # 16-20
 
-with arcpy.da.SearchCursor(input_coding, s_fields, "ACTION_CODE <> '2'") as scursor:
-    with arcpy.da.InsertCursor(name, i_fields) as icursor:
+with arcpy.da.InsertCursor(name, i_fields) as icursor:
 
-        for row in scursor:
+    for row in extract_cache.read_rows(input_coding, s_fields, "ACTION_CODE <> '2'", cache_path = cache_path):
 
-            tipid = row[0]
-            leading0 = "0" * (8- len(tipid))
-            tipid8 = leading0 + tipid
-            tipid10 = f"{tipid8[:2]}-{tipid8[2:4]}-{tipid8[4:]}"
+        tipid = row[0]
+        leading0 = "0" * (8- len(tipid))
+        tipid8 = leading0 + tipid
+        tipid10 = f"{tipid8[:2]}-{tipid8[2:4]}-{tipid8[4:]}"
 
-            toll = row[19]
-            toll_string = f'{toll:.6f}'.rstrip("0").rstrip(".")
+        toll = row[19]
+        toll_string = f'{toll:.6f}'.rstrip("0").rstrip(".")
 
-            modes = row[20]
-            new_modes = "0" if modes == "0" else modes + "00"
+        modes = row[20]
+        new_modes = "0" if modes == "0" else modes + "00"
 
-            insert_row = [
-                tipid10,
-                row[1], row[2], row[3], row[4], row[5],
-                row[6], row[7], row[8], row[9], row[10],
-                row[11], row[12], row[13], row[14], row[15],
-                row[16], row[17], row[18], 
-                toll_string,
-                new_modes
-            ]
+        insert_row = [
+            tipid10,
+            row[1], row[2], row[3], row[4], row[5],
+            row[6], row[7], row[8], row[9], row[10],
+            row[11], row[12], row[13], row[14], row[15],
+            row[16], row[17], row[18], 
+            toll_string,
+            new_modes
+        ]
 
-            icursor.insertRow(insert_row)
+        icursor.insertRow(insert_row)
 
 # CHANGE MODES 
 with arcpy.da.UpdateCursor(name, ["ABB", "NEW_MODES"], "ACTION_CODE = '4' AND NEW_MODES = '200'") as ucursor:
@@ -447,11 +636,19 @@ with arcpy.da.UpdateCursor(name, ["ABB", "NEW_VCLEARANCE"], "ACTION_CODE = '4'")
 
 new_links = os.path.join(output_GDB, "hwynet", "hwynet_arc")
 new_links_fields = [f.name for f in arcpy.ListFields(new_links) if (f.type!="Geometry" and f.name != "OBJECTID")]
-new_links_df = pd.DataFrame(
-            data = [row for row in arcpy.da.SearchCursor(new_links, new_links_fields, "BASELINK = '1'")], 
-            columns = new_links_fields)
 
-link_dict = new_links_df.set_index(["ANODE", "BNODE"]).to_dict("index")
+if low_memory:
+    link_dict.close()
+
+    with arcpy.da.SearchCursor(new_links, new_links_fields, "BASELINK = '1'") as scursor:
+        link_dict = spill.spill_rows(scursor, new_links_fields, os.path.join(spill_path, "new_links"), ["ANODE", "BNODE"])
+
+else:
+    new_links_df = pd.DataFrame(
+                data = [row for row in arcpy.da.SearchCursor(new_links, new_links_fields, "BASELINK = '1'")], 
+                columns = new_links_fields)
+
+    link_dict = new_links_df.set_index(["ANODE", "BNODE"]).to_dict("index")
 
 s_fields = ["TIPID", "ABB", "REP_ANODE", "REP_BNODE"]
 
@@ -466,67 +663,75 @@ i_fields = ["TIPID", "ABB", "ACTION_CODE", "NEW_DIRECTIONS", # 0-3
 rep_abbs = set()
 rep_abb_dict = {}
 
-with arcpy.da.SearchCursor(input_coding, s_fields, "ACTION_CODE = '2'") as scursor:
-    with arcpy.da.InsertCursor(name, i_fields) as icursor:
-
-        for row in scursor:
-
-            tipid = row[0]
-            leading0 = "0" * (8- len(tipid))
-            tipid8 = leading0 + tipid
-            tipid10 = f"{tipid8[:2]}-{tipid8[2:4]}-{tipid8[4:]}"
-
-            abb = row[1]
-            rep_anode = row[2]
-            rep_bnode = row[3]
-
-            if (rep_anode, rep_bnode) not in link_dict:
-                # print(rep_anode, rep_bnode)
-                continue
-                
-            attrs = link_dict[(rep_anode, rep_bnode)]
-
-            new_directions = attrs["DIRECTIONS"]
-            new_type1 = attrs["TYPE1"]
-            new_type2 = attrs["TYPE2"]
-            new_ampm1 = attrs["AMPM1"]
-            new_ampm2 = attrs["AMPM2"]
-            new_postedspeed1 = attrs["POSTEDSPEED1"]
-            new_postedspeed2 = attrs["POSTEDSPEED2"]
-            new_thrulanes1 = attrs["THRULANES1"]
-            new_thrulanes2 = attrs["THRULANES2"]
-            new_thrulanewidth1 = attrs["THRULANEWIDTH1"]
-            new_thrulanewidth2 = attrs["THRULANEWIDTH2"]
-            add_parklanes1 = attrs["PARKLANES1"]
-            add_parklanes2 = attrs["PARKLANES2"]
-            add_sigic = attrs["SIGIC"]
-            add_cltl = attrs["CLTL"]
-            add_rrgradecross = attrs["RRGRADECROSS"]
-            new_tolldollars = attrs["TOLLDOLLARS"]
-            new_modes = attrs["MODES"]
-            new_vclearance = attrs["VCLEARANCE"]
-
-            insert_row = [
-                tipid10, abb, '4', new_directions, new_type1, new_type2,
-                new_ampm1, new_ampm2, new_postedspeed1, new_postedspeed2, new_thrulanes1,
-                new_thrulanes2, new_thrulanewidth1, new_thrulanewidth2, add_parklanes1, add_parklanes2,
-                add_sigic, add_cltl, add_rrgradecross, 
-                new_tolldollars, new_modes, new_vclearance
-            ]
-
-            rep_abb = f"{rep_anode}-{rep_bnode}-1"
-            
-            rep_abbs.add(rep_abb)
-
-            if rep_abb not in rep_abb_dict:
-                rep_abb_dict[rep_abb] = [abb]
-            else:
-                rep_abb_dict[rep_abb].append(abb)
+with arcpy.da.InsertCursor(name, i_fields) as icursor:
+
+    for row in extract_cache.read_rows(input_coding, s_fields, "ACTION_CODE = '2'", cache_path = cache_path):
+
+        tipid = row[0]
+        leading0 = "0" * (8- len(tipid))
+        tipid8 = leading0 + tipid
+        tipid10 = f"{tipid8[:2]}-{tipid8[2:4]}-{tipid8[4:]}"
+
+        abb = row[1]
+        rep_anode = row[2]
+        rep_bnode = row[3]
+
+        if (rep_anode, rep_bnode) not in link_dict:
+            # print(rep_anode, rep_bnode)
+            continue
+
+        attrs = link_dict[(rep_anode, rep_bnode)]
+
+        new_directions = attrs["DIRECTIONS"]
+        new_type1 = attrs["TYPE1"]
+        new_type2 = attrs["TYPE2"]
+        new_ampm1 = attrs["AMPM1"]
+        new_ampm2 = attrs["AMPM2"]
+        new_postedspeed1 = attrs["POSTEDSPEED1"]
+        new_postedspeed2 = attrs["POSTEDSPEED2"]
+        new_thrulanes1 = attrs["THRULANES1"]
+        new_thrulanes2 = attrs["THRULANES2"]
+        new_thrulanewidth1 = attrs["THRULANEWIDTH1"]
+        new_thrulanewidth2 = attrs["THRULANEWIDTH2"]
+        add_parklanes1 = attrs["PARKLANES1"]
+        add_parklanes2 = attrs["PARKLANES2"]
+        add_sigic = attrs["SIGIC"]
+        add_cltl = attrs["CLTL"]
+        add_rrgradecross = attrs["RRGRADECROSS"]
+        new_tolldollars = attrs["TOLLDOLLARS"]
+        new_modes = attrs["MODES"]
+        new_vclearance = attrs["VCLEARANCE"]
+
+        insert_row = [
+            tipid10, abb, '4', new_directions, new_type1, new_type2,
+            new_ampm1, new_ampm2, new_postedspeed1, new_postedspeed2, new_thrulanes1,
+            new_thrulanes2, new_thrulanewidth1, new_thrulanewidth2, add_parklanes1, add_parklanes2,
+            add_sigic, add_cltl, add_rrgradecross, 
+            new_tolldollars, new_modes, new_vclearance
+        ]
+
+        rep_abb = f"{rep_anode}-{rep_bnode}-1"
+
+        rep_abbs.add(rep_abb)
+
+        if rep_abb not in rep_abb_dict:
+            rep_abb_dict[rep_abb] = [abb]
+        else:
+            rep_abb_dict[rep_abb].append(abb)
 
-            icursor.insertRow(insert_row)
+        icursor.insertRow(insert_row)
 
 print(f"{len(rep_abbs)} links were replaced. Check csv for attributes.")
-rep_abbs_df = new_links_df[new_links_df.ABB.isin(rep_abbs)]
+
+if low_memory:
+    rep_abbs_df = link_dict.select("ABB", rep_abbs)
+    link_dict.close()
+    spill.remove_spill_dir(spill_path)
+else:
+    rep_abbs_df = new_links_df[new_links_df.ABB.isin(rep_abbs)]
+    del new_links_df
+
+del link_dict
 
 field_list = ["ABB", "PARKRES1", "PARKRES2", "NHSIC", "SRA", 
               "CHIBLVD", "TOLLSYS", "TRUCKRTE", "MESO", "REPLACES"]
@@ -539,9 +744,48 @@ rep_abbs_df["REPLACES"] = rep_abbs_df["ABB"].apply(replace_abbs)
 
 rep_abbs_df[field_list].to_csv(os.path.join(output_path, "replaced_abbs.csv"), index = False)
 
+# CHECK CODING AGAINST PROJECT GEOMETRY
+if check_hwyproj_geometry:
+
+    arc_keys, *arc_geom = geometry.read_geometry(input_links, "ABB", cache_path = cache_path)
+    proj_keys, *proj_geom = geometry.read_geometry(input_proj, "TIPID", cache_path = cache_path)
+
+    proj_keys = pd.Series(proj_keys).str.zfill(8)
+    proj_keys = (proj_keys.str[:2] + "-" + proj_keys.str[2:4] + "-" + proj_keys.str[4:]).to_numpy()
+
+    match_df = spatial_grid.match_lines(arc_keys, arc_geom, proj_keys, proj_geom, hwyproj_tolerance)
+    match_df = match_df.rename(columns = {"LINE": "TIPID", "ARC": "ABB"})
+
+    coding_df = pd.DataFrame(
+                data = [row for row in arcpy.da.SearchCursor(name, ["TIPID", "ABB", "ACTION_CODE"])], 
+                columns = ["TIPID", "ABB", "ACTION_CODE"])
+
+    # coding rows far from their project (or on an ABB that is not in hwynet_arc), measured
+    # to the nearest of the project's features. DISTANCE is blank when it is beyond hwyproj_far_distance
+    pairs_df = coding_df.loc[coding_df.ABB.isin(arc_keys) & coding_df.TIPID.isin(proj_keys), ["ABB", "TIPID"]].drop_duplicates()
+    pairs_df = pairs_df.rename(columns = {"ABB": "KEY1", "TIPID": "KEY2"})
+    pairs_df["DISTANCE"] = spatial_grid.pair_distances(pairs_df, arc_keys, arc_geom, proj_keys, proj_geom, hwyproj_far_distance)
+    pairs_df = pairs_df.rename(columns = {"KEY1": "ABB", "KEY2": "TIPID"})
+
+    coding_df = coding_df.merge(pairs_df, how = "left", on = ["ABB", "TIPID"])
+    known = coding_df.ABB.isin(arc_keys) & coding_df.TIPID.isin(proj_keys)
+
+    far_df = coding_df[~coding_df.ABB.isin(arc_keys) | (known & coding_df.DISTANCE.isna())]
+    far_df.to_csv(os.path.join(output_path, "hwyproj_far_coding.csv"), index = False)
+
+    # arcs a project runs along that its coding does not mention
+    coded = pd.MultiIndex.from_frame(coding_df[["TIPID", "ABB"]])
+    missing_df = match_df[~pd.MultiIndex.from_frame(match_df[["TIPID", "ABB"]]).isin(coded)]
+    missing_df = missing_df[missing_df.TIPID.isin(coding_df.TIPID)]
+    missing_df.to_csv(os.path.join(output_path, "hwyproj_missing_abbs.csv"), index = False)
+
+    print(f"{len(far_df)} coding rows are far from their project and {len(missing_df)} ABBs may be missing from coding. Check csvs.")
+
+    del arc_geom, proj_geom, match_df, coding_df, pairs_df
+
 # ADD BUS DOMAINS ---------------------------------------------------------------------------------
 
-print("Adding bus domains...")
+start_stage("Adding bus domains...")
 
 name = "BUSMODE"
 description = "Bus mode code"
@@ -587,7 +831,7 @@ for code in code_dict:
 
 # ADD BUS BASE ------------------------------------------------------------------------------------
 
-print("Creating bus base feature class...")
+start_stage("Creating bus base feature class...")
 
 workspace = os.path.join(output_GDB, "hwynet")
 name = "bus_base"
@@ -609,7 +853,7 @@ arcpy.management.AddFields(name,
 
 # ADD BUS CURRENT ---------------------------------------------------------------------------------
 
-print("Creating bus current feature class...")
+start_stage("Creating bus current feature class...")
 
 workspace = os.path.join(output_GDB, "hwynet")
 name = "bus_current"
@@ -631,33 +875,45 @@ arcpy.management.AddFields(name,
 
 input_fc = os.path.join(input_mhn, "hwynet", name + "_2024")
 
-s_fields = ["SHAPE@", "TRANSIT_LINE", "MODE", "VEHICLE_TYPE",
+s_fields = ["SHAPE@WKB", "TRANSIT_LINE", "MODE", "VEHICLE_TYPE",
             "HEADWAY", "SPEED", "DIRECTION", "START", 
             "STARTHOUR", "FEEDLINE", "LONGNAME"]
 
-i_fields = ["SHAPE@", "TRANSIT_LINE", "MODE", "VEHICLE_TYPE",
+i_fields = ["SHAPE@WKB", "TRANSIT_LINE", "MODE", "VEHICLE_TYPE",
             "HEADWAY", "SPEED", "DIRECTION", "START",
             "STARTHOUR", "FEEDLINE", "ROUTE_ID", "DESCRIPTION"]
 
-with arcpy.da.SearchCursor(input_fc, s_fields) as scursor:
-    with arcpy.da.InsertCursor(name, i_fields) as icursor:
+bus_current_df = extract_cache.read_table(input_fc, s_fields, cache_path = cache_path)
+bus_current_df["ROUTE_ID"], bus_current_df["DESCRIPTION"], reason = bus_routes.parse_longnames(bus_current_df["LONGNAME"])
 
-        for row in scursor:
+# lines with names that can't be parsed are still added, without ROUTE_ID and DESCRIPTION
+reject_df = bus_current_df.loc[reason.notna(), ["TRANSIT_LINE", "LONGNAME"]]
+reject_df["REASON"] = reason[reason.notna()]
+reject_df.to_csv(os.path.join(output_path, "bus_current_longname_rejects.csv"), index = False)
 
-            longname = row[10]
-            route_id = longname.split()[0].split("-")[0]
-            desc = route_id + " " + longname.split(maxsplit = 2)[2]
-            desc = desc[0:50]
-            
-            insert_row = [row[0], row[1], row[2], row[3], 
-                          row[4], row[5], row[6], row[7],
-                          row[8], row[9], route_id, desc]
-            
-            icursor.insertRow(insert_row)
+if len(reject_df) > 0:
+    print(f"{len(reject_df)} bus_current LONGNAMEs could not be parsed. See bus_current_longname_rejects.csv.")
+
+with arcpy.da.InsertCursor(name, i_fields) as icursor:
+
+    insert_df = bus_current_df[i_fields]
+    for row in insert_df.astype(object).where(insert_df.notna(), None).itertuples(index = False, name = None):
+        icursor.insertRow(row)
+
+# ROUTE_ID -> TRANSIT_LINE lookup, so per-route queries don't have to scan bus_current
+# every line, rejected names included, for the service tables below. only the
+# ROUTE_ID lookup is limited to lines whose name could be parsed
+current_lines_df = bus_current_df[["TRANSIT_LINE", "ROUTE_ID", "DIRECTION", "STARTHOUR"]]
+
+route_lines_df = bus_current_df.loc[reason.isna(), ["ROUTE_ID", "DIRECTION", "TRANSIT_LINE", "STARTHOUR"]]
+route_lines_df = route_lines_df.sort_values(["ROUTE_ID", "DIRECTION", "STARTHOUR", "TRANSIT_LINE"])
+write_table("bus_current_route", route_lines_df)
+
+del bus_current_df, insert_df, reject_df, reason, route_lines_df
 
 # ADD BUS FUTURE ----------------------------------------------------------------------------------
 
-print("Creating bus future feature class...")
+start_stage("Creating bus future feature class...")
 
 workspace = os.path.join(output_GDB, "hwynet")
 name = "bus_future"
@@ -679,19 +935,18 @@ arcpy.management.AddFields(name,
 
 input_fc = os.path.join(input_mhn, "hwynet", name + "_2024")
 
-fields = ["SHAPE@", "TRANSIT_LINE", "DESCRIPTION", "MODE",
+fields = ["SHAPE@WKB", "TRANSIT_LINE", "DESCRIPTION", "MODE",
           "VEHICLE_TYPE", "HEADWAY", "SPEED", "SCENARIO",
           "REPLACE", "REROUTE", "TOD", "NOTES"]
 
-with arcpy.da.SearchCursor(input_fc, fields) as scursor:
-    with arcpy.da.InsertCursor(name, fields) as icursor:
-        
-        for row in scursor:
-            icursor.insertRow(row)
+with arcpy.da.InsertCursor(name, fields) as icursor:
+
+    for row in extract_cache.read_rows(input_fc, fields, cache_path = cache_path):
+        icursor.insertRow(row)
 
 # ADD BUS BASE ITIN -------------------------------------------------------------------------------
 
-print("Creating bus base itinerary table...")
+start_stage("Creating bus base itinerary table...")
 
 name = "bus_base_itin"
 arcpy.management.CreateTable(output_GDB, name)
@@ -744,25 +999,9 @@ arcpy.management.AddFields(name,
 
 # ADD BUS CURRENT ITIN ----------------------------------------------------------------------------
 
-print("Creating bus current itinerary table...")
+start_stage("Creating bus current itinerary table...")
 
 name = "bus_current_itin"
-arcpy.management.CreateTable(output_GDB, name)
-
-schema_df = pd.read_csv(os.path.join(schema, f"{name}.csv"))
-schema_df = schema_df.replace(np.nan, None)
-
-schema_list = [[row["NAME"], 
-                row["TYPE"], 
-                row["ALIAS"], 
-                row["LENGTH"], 
-                row["DEFAULT"], 
-                row["DOMAIN"]] 
-               for index, row in schema_df.iterrows()]
-
-arcpy.management.AddFields(name,
-                           schema_list)
-
 input_table = os.path.join(input_mhn, name + "_2024")
 
 fields = ["TRANSIT_LINE", "ITIN_ORDER", "ITIN_A", "ITIN_B",
@@ -770,15 +1009,57 @@ fields = ["TRANSIT_LINE", "ITIN_ORDER", "ITIN_A", "ITIN_B",
           "LINE_SERV_TIME", "TTF", "LINK_STOPS", "IMPUTED", 
           "DEP_TIME", "ARR_TIME", "F_MEAS", "T_MEAS"]
 
-with arcpy.da.SearchCursor(input_table, fields) as scursor:
+# with dedup_itineraries the itinerary is only stored as paths + lines (below)
+if dedup_itineraries:
+    itin_df = extract_cache.read_table(input_table, fields, cache_path = cache_path)
+
+else:
+    arcpy.management.CreateTable(output_GDB, name)
+
+    schema_df = pd.read_csv(os.path.join(schema, f"{name}.csv"))
+    schema_df = schema_df.replace(np.nan, None)
+
+    schema_list = [[row["NAME"], 
+                    row["TYPE"], 
+                    row["ALIAS"], 
+                    row["LENGTH"], 
+                    row["DEFAULT"], 
+                    row["DOMAIN"]] 
+                   for index, row in schema_df.iterrows()]
+
+    arcpy.management.AddFields(name,
+                               schema_list)
+
     with arcpy.da.InsertCursor(name, fields) as icursor:
 
-        for row in scursor:
+        for row in extract_cache.read_rows(input_table, fields, cache_path = cache_path):
             icursor.insertRow(row)
 
+# ADD BUS CURRENT ITIN PATHS ----------------------------------------------------------------------
+
+if dedup_itineraries:
+
+    start_stage("Creating bus current itinerary path tables...")
+
+    paths_df, lines_df = itin_store.build_store(itin_df)
+
+    # the store must give back exactly the rows it replaces, not just the same number of them
+    expanded_df = itin_store.expand_itinerary(paths_df, lines_df)[fields]
+    sorted_df = itin_df.sort_values(["TRANSIT_LINE", "ITIN_ORDER"]).reset_index(drop = True)[fields]
+
+    if not expanded_df.astype(object).where(expanded_df.notna(), None).equals(sorted_df.astype(object).where(sorted_df.notna(), None)):
+        raise ValueError("Itinerary paths do not expand back to bus_current_itin.")
+
+    print(f"{len(lines_df)} lines share {len(paths_df.PATH_ID.unique())} paths ({len(paths_df)} of {len(itin_df)} rows kept).")
+
+    write_table("bus_current_itin_path", paths_df)
+    write_table("bus_current_itin_line", lines_df)
+
+    del itin_df, paths_df, lines_df, expanded_df, sorted_df
+
 # ADD BUS FUTURE ITIN -----------------------------------------------------------------------------
 
-print("Creating bus future itinerary table...")
+start_stage("Creating bus future itinerary table...")
 
 name = "bus_future_itin"
 arcpy.management.CreateTable(output_GDB, name)
@@ -803,15 +1084,14 @@ fields = ["TRANSIT_LINE", "ITIN_ORDER", "ITIN_A", "ITIN_B",
           "ABB", "LAYOVER", "DWELL_CODE", "ZONE_FARE",
           "LINE_SERV_TIME", "TTF", "F_MEAS", "T_MEAS"]
 
-with arcpy.da.SearchCursor(input_table, fields) as scursor:
-    with arcpy.da.InsertCursor(name, fields) as icursor:
+with arcpy.da.InsertCursor(name, fields) as icursor:
 
-        for row in scursor:
-            icursor.insertRow(row)
+    for row in extract_cache.read_rows(input_table, fields, cache_path = cache_path):
+        icursor.insertRow(row)
 
 # ADD PARKNRIDE TABLE -----------------------------------------------------------------------------
 
-print("Creating park n ride table...")
+start_stage("Creating park n ride table...")
 
 name = "parknride"
 arcpy.management.CreateTable(output_GDB, name)
@@ -833,15 +1113,58 @@ arcpy.management.AddFields(name,
 
 fields = ["FACILITY", "NODE", "COST", "SPACES", "ESTIMATE", "SCENARIO"]
 
-with arcpy.da.SearchCursor(input_table, fields) as scursor:
-    with arcpy.da.InsertCursor(name, fields) as icursor:
+with arcpy.da.InsertCursor(name, fields) as icursor:
 
-        for row in scursor:
-            icursor.insertRow(row)
+    for row in extract_cache.read_rows(input_table, fields, cache_path = cache_path):
+        icursor.insertRow(row)
+
+# ADD SERVICE TABLES ------------------------------------------------------------------------------
+
+service_table_names = ["bus_current_route_hour", "bus_current_route_tod", "bus_current_link_tod",
+                       "bus_future_route_tod", "bus_future_link_tod"]
+
+if build_service_tables:
+
+    start_stage("Creating transit service tables...")
+
+    lines_df = current_lines_df
+    itin_df = extract_cache.read_table(os.path.join(input_mhn, "bus_current_itin_2024"), ["TRANSIT_LINE", "ABB"], cache_path = cache_path)
+
+    route_hour_df, route_tod_df, line_trips_df = service_tables.current_route_tables(lines_df)
+    write_table("bus_current_route_hour", route_hour_df)
+    write_table("bus_current_route_tod", route_tod_df)
+    write_table("bus_current_link_tod", service_tables.link_table(itin_df, line_trips_df))
+
+    lines_df = extract_cache.read_table(os.path.join(input_mhn, "hwynet", "bus_future_2024"), ["TRANSIT_LINE", "HEADWAY", "TOD"], cache_path = cache_path)
+    itin_df = extract_cache.read_table(os.path.join(input_mhn, "bus_future_itin_2024"), ["TRANSIT_LINE", "ABB"], cache_path = cache_path)
+
+    route_tod_df, line_trips_df = service_tables.future_route_tables(lines_df)
+    write_table("bus_future_route_tod", route_tod_df)
+    write_table("bus_future_link_tod", service_tables.link_table(itin_df, line_trips_df))
+
+    del current_lines_df, lines_df, itin_df, route_hour_df, route_tod_df, line_trips_df
+
+# BUILD INDEXES -----------------------------------------------------------------------------------
+
+start_stage("Building indexes...")
+
+add_indexes(["hwynet_node", "hwynet_arc", "hwyproj", "hwyproj_coding",
+             "bus_base", "bus_current", "bus_future",
+             "bus_base_itin", "bus_future_itin",
+             "parknride", "bus_current_route"])
+
+if not dedup_itineraries:
+    add_indexes(["bus_current_itin"])
+
+if dedup_itineraries:
+    add_indexes(["bus_current_itin_path", "bus_current_itin_line"])
+
+if build_service_tables:
+    add_indexes(service_table_names)
 
 # ADD OVERRIDES -----------------------------------------------------------------------------------
 
-print("ADDING OVERRIDES. MAKE SURE THAT YOU ARE OKAY WITH THESE.")
+start_stage("ADDING OVERRIDES. MAKE SURE THAT YOU ARE OKAY WITH THESE.")
 
 # # prevent problems with arcs
 # arcpy.management.MakeFeatureLayer("hwynet_arc", "hwylink_layer")
@@ -906,7 +1229,7 @@ arcpy.management.CalculateField("coding_view", "NEW_MODES", "'0'")
 
 # ADD RELATIONSHIP CLASSES ------------------------------------------------------------------------
 
-print("Adding relationship classes...")
+start_stage("Adding relationship classes...")
 
 # add rel_hwyproj_to_coding
 arcpy.management.CreateRelationshipClass(
@@ -923,17 +1246,20 @@ arcpy.management.CreateRelationshipClass(
 # add rel_bus_x_to_itin
 xes = ["base", "current", "future"]
 
+# (a deduplicated bus_current itinerary relates through its line and path tables)
 for x in xes:
+    itin = "bus_current_itin_line" if x == "current" and dedup_itineraries else f"bus_{x}_itin"
     arcpy.management.CreateRelationshipClass(
-        f"bus_{x}", f"bus_{x}_itin", f"rel_bus_{x}_to_itin",
-        "COMPOSITE", f"bus_{x}_itin", f"bus_{x}", "FORWARD", "ONE_TO_MANY", 
+        f"bus_{x}", itin, f"rel_bus_{x}_to_itin",
+        "COMPOSITE", itin, f"bus_{x}", "FORWARD", "ONE_TO_MANY", 
         "NONE", "TRANSIT_LINE", "TRANSIT_LINE")
             
 # add rel_arcs_to_bus_x_itin
 for x in xes:
+    itin = "bus_current_itin_path" if x == "current" and dedup_itineraries else f"bus_{x}_itin"
     arcpy.management.CreateRelationshipClass(
-        "hwynet_arc", f"bus_{x}_itin", f"rel_arcs_to_bus_{x}_itin",
-        "SIMPLE", f"bus_{x}_itin", "hwynet_arc", "NONE", "ONE_TO_MANY",
+        "hwynet_arc", itin, f"rel_arcs_to_bus_{x}_itin",
+        "SIMPLE", itin, "hwynet_arc", "NONE", "ONE_TO_MANY",
         "NONE", "ABB", "ABB")
             
 # add rel_nodes_to_parknride
@@ -942,4 +1268,64 @@ arcpy.management.CreateRelationshipClass(
     "SIMPLE", "parknride", "hwynet_node", "NONE", "ONE_TO_MANY",
     "NONE", "NODE", "NODE")
 
+# EXPORT EMME FILES -------------------------------------------------------------------------------
+
+if export_emme:
+
+    start_stage("Exporting Emme batch-in files...")
+    emme_export.export(output_GDB, os.path.join(output_path, "emme"), xes)
+
+# CHECK AND PUBLISH OUTPUT ------------------------------------------------------------------------
+
+start_stage("Checking output...")
+
+problems = []
+
+copied_tables = [["hwynet_node", os.path.join(input_mhn, "hwynet", "hwynet_node")],
+                 ["hwynet_arc", os.path.join(input_mhn, "hwynet", "hwynet_arc")],
+                 ["hwyproj", os.path.join(input_mhn, "hwynet", "hwyproj")],
+                 ["bus_current", os.path.join(input_mhn, "hwynet", "bus_current_2024")],
+                 ["bus_future", os.path.join(input_mhn, "hwynet", "bus_future_2024")],
+                 ["bus_future_itin", os.path.join(input_mhn, "bus_future_itin_2024")],
+                 ["parknride", os.path.join(input_mhn, "parknride")]]
+
+# the path store is checked row for row against the source when it is built
+if not dedup_itineraries:
+    copied_tables.append(["bus_current_itin", os.path.join(input_mhn, "bus_current_itin_2024")])
+
+for table, input_table in copied_tables:
+
+    new_count = int(arcpy.management.GetCount(table)[0])
+    old_count = int(arcpy.management.GetCount(input_table)[0])
+
+    if new_count != old_count:
+        problems.append(f"{table} has {new_count} rows, expected {old_count}.")
+
+if int(arcpy.management.GetCount("hwyproj_coding")[0]) == 0:
+    problems.append("hwyproj_coding is empty.")
+
+rel_classes = ["rel_hwyproj_to_coding", "rel_arcs_to_hwyproj_coding", "rel_nodes_to_parknride"]
+rel_classes += [f"rel_bus_{x}_to_itin" for x in xes] + [f"rel_arcs_to_bus_{x}_itin" for x in xes]
+
+for rel_class in rel_classes:
+    if not arcpy.Exists(rel_class):
+        problems.append(f"{rel_class} is missing.")
+
+# release locks on the staging gdb so its folder can be moved
+arcpy.management.Delete("coding_view")
+arcpy.env.workspace = None
+arcpy.management.ClearWorkspaceCache()
+
+if problems:
+    for problem in problems:
+        print(problem)
+    sys.exit(f"Output checks failed. Build left in {output_path}; published output is unchanged.")
+
+end_stage()
+pd.DataFrame(stage_times, columns = ["STAGE", "SECONDS", "MEMORY_MB"]).to_csv(
+    os.path.join(output_path, "stage_times.csv"), index = False)
+
+build_path = publish.publish(output_root, output_path, keep_builds)
+print(f"Published {build_path} (output/current).")
+
 print("Done")
\ No newline at end of file
@@ -0,0 +1,39 @@
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import bus_routes
+
+def parse(names, dtype = object):
+
+    route_id, desc, reason = bus_routes.parse_longnames(pd.Series(names, dtype = dtype))
+    return list(route_id), list(desc), list(reason)
+
+def test_matches_split_parsing():
+
+    names = ["52-1 SB KOSTNER  Foo bar", "8A-2 NB Halsted   st", "X9 EB " + "x" * 60]
+    route_id, desc, reason = parse(names)
+
+    for name, r, d in zip(names, route_id, desc):
+        expected = name.split()[0].split("-")[0]
+        assert r == expected
+        assert d == (expected + " " + name.split(maxsplit = 2)[2])[0:50]
+
+    assert reason == [None, None, None]
+
+def test_malformed_names_are_rejected():
+
+    route_id, desc, reason = parse(["X9 only", None, "  ", "-5 a b", "TOOLONG6 a b"])
+
+    assert route_id == [None] * 5
+    assert desc == [None] * 5
+    assert reason == ["fewer than 3 words", "no LONGNAME", "no LONGNAME", "no route id", "route id longer than 5"]
+
+def test_all_null_and_empty():
+
+    assert parse([None, None]) == ([None, None], [None, None], ["no LONGNAME", "no LONGNAME"])
+    assert parse(["", "   "], dtype = "str") == ([None, None], [None, None], ["no LONGNAME", "no LONGNAME"])
+    assert parse([]) == ([], [], [])
+    assert parse([], dtype = "str") == ([], [], [])
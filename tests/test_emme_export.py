@@ -0,0 +1,23 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import emme_export
+
+def test_number_keeps_seven_digit_coordinates():
+
+    values = pd.Series([1123456.789, 1906543.25, 987654.0])
+    assert emme_export.number(values).tolist() == ["1123456.789", "1906543.25", "987654"]
+
+def test_number_rounds_and_trims():
+
+    values = pd.Series([0.12346, 2.5, 3.0, None, -0.00001, -1.25])
+    assert emme_export.number(values).tolist() == ["0.1235", "2.5", "3", "0", "0", "-1.25"]
+
+def test_text_prints_integral_floats_as_ints():
+
+    values = pd.Series([104.0, np.nan, 7.0])
+    assert emme_export.text(values).tolist() == ["104", "0", "7"]
@@ -0,0 +1,56 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import extract_cache
+
+pa = pytest.importorskip("pyarrow")
+
+def write_cache(path, batches):
+
+    schema = pa.schema([("ABB", pa.string()), ("ACTION_CODE", pa.string()), ("IMArea", pa.int64()), ("SHAPE@WKB", pa.binary())])
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for rows in batches:
+                writer.write_batch(pa.record_batch([pa.array(column, type = t) for column, t in zip(zip(*rows), schema.types)], schema = schema))
+
+    return path
+
+@pytest.fixture
+def cache_file(tmp_path):
+
+    return write_cache(str(tmp_path / "table.arrow"), [
+        [("1-2-1", "1", 1, b"\x01"), ("2-3-1", "2", None, b"\x02")],
+        [("3-4-1", None, 3, None), ("4-5-1", "2", 4, b"\x04")]
+    ])
+
+def test_rows_stream_every_batch_with_nulls_as_none(cache_file):
+
+    rows = list(extract_cache.arrow_rows(cache_file, ["ABB", "IMArea", "SHAPE@"]))
+
+    assert rows == [("1-2-1", 1, b"\x01"), ("2-3-1", None, b"\x02"), ("3-4-1", 3, None), ("4-5-1", 4, b"\x04")]
+
+def test_field_names_match_without_case(cache_file):
+
+    # arcpy finds IMArea when asked for IMAREA; the cache has to as well
+    rows = list(extract_cache.arrow_rows(cache_file, ["abb", "IMAREA"], "action_code = '2'"))
+    assert rows == [("2-3-1", None), ("4-5-1", 4)]
+
+    df = extract_cache.arrow_table(cache_file, ["ABB", "IMAREA"], "ACTION_CODE <> '2'")
+    assert list(df.columns) == ["ABB", "IMAREA"]
+    assert df["ABB"].tolist() == ["1-2-1"]
+
+def test_unknown_field_raises(cache_file):
+
+    with pytest.raises(KeyError):
+        list(extract_cache.arrow_rows(cache_file, ["NOPE"]))
+
+def test_where_clause_drops_nulls_like_sql(cache_file):
+
+    rows = list(extract_cache.arrow_rows(cache_file, ["ABB"], "ACTION_CODE <> '2'"))
+    assert rows == [("1-2-1",)]
+
+    rows = list(extract_cache.arrow_rows(cache_file, ["ABB"], "IMArea >= 3"))
+    assert rows == [("3-4-1",), ("4-5-1",)]
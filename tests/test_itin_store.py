@@ -0,0 +1,40 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import itin_store
+
+FIELDS = ["TRANSIT_LINE", "ITIN_ORDER", "ITIN_A", "ITIN_B", "ABB", "LAYOVER", "DEP_TIME", "ARR_TIME"]
+
+def itinerary():
+
+    rows = []
+    # L1 and L2 are the same run at different times, L3 has the same stops with other timing
+    for line, base, step in [["L1", 100, 10], ["L2", 200, 10], ["L3", 300, 12]]:
+        for order in range(1, 4):
+            rows.append([line, order, order, order + 1 if order != 2 else np.nan, f"{order}-{order + 1}-1", 0,
+                         base + order * step, base + order * step + 5])
+
+    return pd.DataFrame(rows, columns = FIELDS).sample(frac = 1, random_state = 1)
+
+def test_runs_with_the_same_pattern_share_a_path():
+
+    paths, lines = itin_store.build_store(itinerary())
+
+    path_of = dict(zip(lines.TRANSIT_LINE, lines.PATH_ID))
+    assert path_of["L1"] == path_of["L2"]
+    assert path_of["L3"] != path_of["L1"]
+    assert len(paths) == 6
+
+def test_expansion_gives_back_every_row():
+
+    itin_df = itinerary()
+    paths, lines = itin_store.build_store(itin_df)
+
+    expanded = itin_store.expand_itinerary(paths, lines)[FIELDS]
+    expected = itin_df.sort_values(["TRANSIT_LINE", "ITIN_ORDER"]).reset_index(drop = True)[FIELDS]
+
+    pd.testing.assert_frame_equal(expanded, expected, check_dtype = False)
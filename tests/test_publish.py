@@ -0,0 +1,64 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import publish
+
+def make_build(output_root, name, text):
+
+    staging_path = os.path.join(output_root, "staging", name)
+    os.makedirs(staging_path)
+    with open(os.path.join(staging_path, "marker.txt"), "w") as f:
+        f.write(text)
+
+    return staging_path
+
+def read_current(output_root):
+
+    with open(os.path.join(output_root, "current", "marker.txt"), "r") as f:
+        return f.read()
+
+def test_publish_with_relative_output_root(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+
+    publish.publish("out", make_build("out", "build_1", "one"))
+    publish.publish("out", make_build("out", "build_2", "two"))
+
+    assert os.path.exists(os.path.join("out", "current"))
+    assert read_current("out") == "two"
+    assert publish.current_build("out") == "build_2"
+
+    # the link must also resolve from anywhere else
+    monkeypatch.chdir(tmp_path / "out")
+    assert read_current(".") == "two"
+    assert read_current(str(tmp_path / "out")) == "two"
+
+def test_rollback_and_prune(tmp_path):
+
+    output_root = str(tmp_path)
+    for i in range(1, 5):
+        publish.publish(output_root, make_build(output_root, f"build_{i}", str(i)), keep = 3)
+
+    assert publish.list_builds(output_root) == ["build_2", "build_3", "build_4"]
+    assert publish.rollback(output_root) == "build_3"
+    assert read_current(output_root) == "3"
+
+    with pytest.raises(FileNotFoundError):
+        publish.rollback(output_root, "build_1")
+
+def test_legacy_output_is_removed(tmp_path, capsys):
+
+    output_root = str(tmp_path)
+    os.makedirs(os.path.join(output_root, "MHN_new.gdb"))
+    with open(os.path.join(output_root, "replaced_abbs.csv"), "w") as f:
+        f.write("ABB\n")
+
+    publish.publish(output_root, make_build(output_root, "build_1", "one"))
+
+    assert not os.path.exists(os.path.join(output_root, "MHN_new.gdb"))
+    assert not os.path.exists(os.path.join(output_root, "replaced_abbs.csv"))
+    assert "WARNING" in capsys.readouterr().out
+    assert read_current(output_root) == "one"
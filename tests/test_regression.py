@@ -0,0 +1,84 @@
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import regression
+
+def snapshot(tables = None, reports = None, domains = None, relationships = None):
+
+    return {"tables": tables or {}, "reports": reports or {}, "domains": domains or {}, "relationships": relationships or {}}
+
+def entry(hashes, fields = ["A"]):
+
+    return {"fields": fields, "rows": len(hashes), "hashes": hashes}
+
+def test_row_hash_rounds_floats_and_hashes_bytes():
+
+    assert regression.row_hash([1, 0.1 + 0.2, "x"]) == regression.row_hash([1, 0.3, "x"])
+    assert regression.row_hash([b"\x01\x02"]) == regression.row_hash([bytearray(b"\x01\x02")])
+    assert regression.row_hash([1, None]) != regression.row_hash([1, 0])
+    assert regression.row_hash(["1"]) != regression.row_hash([1])
+
+def test_csv_snapshot_ignores_row_order(tmp_path):
+
+    first = tmp_path / "a.csv"
+    second = tmp_path / "b.csv"
+    first.write_text("ABB,MILES\n1-2-1,0.5\n2-3-1,\n")
+    second.write_text("ABB,MILES\n2-3-1,\n1-2-1,0.5\n")
+
+    snap = regression.csv_snapshot(str(first))
+    assert snap["fields"] == ["ABB", "MILES"]
+    assert snap["rows"] == 2
+    assert snap == regression.csv_snapshot(str(second))
+
+def test_text_snapshot_keeps_line_order(tmp_path):
+
+    first = tmp_path / "a.d221"
+    second = tmp_path / "b.d221"
+    first.write_text("  1\n  2\n")
+    second.write_text("  2\n  1\n")
+
+    assert regression.text_snapshot(str(first)) != regression.text_snapshot(str(second))
+
+def test_compare_snapshots():
+
+    golden = snapshot(tables = {"t": entry(["a", "b"]), "gone": entry([])},
+                      reports = {"emme/x.d221": entry(["1", "2"], [])},
+                      domains = {"t.TYPE1": 1}, relationships = {"rel": 0})
+
+    assert regression.compare_snapshots(golden, golden) == []
+
+    current = snapshot(tables = {"t": entry(["a", "c", "d"]), "new": entry([])},
+                       reports = {"emme/x.d221": entry(["2", "1"], [])},
+                       domains = {"t.TYPE1": 1}, relationships = {"rel": 3})
+
+    assert regression.compare_snapshots(golden, current) == [
+        "gone is missing from the output.",
+        "new is new (not in the golden snapshot).",
+        "t rows changed: 2 added, 1 removed.",
+        "emme/x.d221 lines are in a different order.",
+        "relationships check rel: 3 bad rows (golden 0)."
+    ]
+
+    current = snapshot(tables = {"t": entry(["a", "b"], ["A", "B"]), "gone": entry([])},
+                       reports = {"emme/x.d221": entry(["1", "2"], [])},
+                       domains = {"t.TYPE1": 0}, relationships = {"rel": 0})
+
+    assert regression.compare_snapshots(golden, current) == ["t fields changed: ['A'] -> ['A', 'B']."]
+
+def test_compare_budgets():
+
+    budgets = {"fast": {"SECONDS": 0.5, "MEMORY_MB": 10}, "slow": {"SECONDS": 100, "MEMORY_MB": 1000}}
+
+    stage_df = pd.DataFrame({"STAGE": ["fast", "slow"], "SECONDS": [1.9, 124.0], "MEMORY_MB": [55, 1240]})
+    assert regression.compare_budgets(budgets, stage_df, 0.25) == []
+
+    stage_df = pd.DataFrame({"STAGE": ["fast", "slow", "added"], "SECONDS": [2.5, 130.0, 1.0], "MEMORY_MB": [70, None, 5]})
+    assert regression.compare_budgets(budgets, stage_df, 0.25) == [
+        "Stage 'fast' took 2.5s (budget 0.5s + 25%).",
+        "Stage 'fast' used 70 MB (budget 10 MB + 25%).",
+        "Stage 'slow' took 130.0s (budget 100s + 25%).",
+        "Stage 'added' has no budget. Run with --update to record one."
+    ]
@@ -0,0 +1,52 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import service_tables
+
+def test_tod_periods_cover_the_day():
+
+    assert (service_tables.HOUR_TOD > 0).all()
+    assert service_tables.TOD_MINUTES.sum() == 24 * 60
+
+def test_current_tables():
+
+    lines_df = pd.DataFrame({
+        "TRANSIT_LINE": ["a1", "a2", "a3", "b1", "c1"],
+        "ROUTE_ID": ["52", "52", "52", None, "9"],
+        "DIRECTION": ["N", "N", "S", "E", "W"],
+        "STARTHOUR": [7, 8, 7, 7, None]
+    })
+    itin_df = pd.DataFrame({"TRANSIT_LINE": ["a1", "a2", "a3", "b1", "b1", "c1"],
+                            "ABB": ["x", "x", "x", "x", "x", "x"]})
+
+    route_hour, route_tod, line_trips = service_tables.current_route_tables(lines_df)
+
+    assert route_hour.set_index(["ROUTE_ID", "DIRECTION", "HOUR"])["TRIPS"].to_dict() == {("52", "N", 7): 1, ("52", "N", 8): 1, ("52", "S", 7): 1}
+    tod3 = route_tod[(route_tod.ROUTE_ID == "52") & (route_tod.DIRECTION == "N")].iloc[0]
+    assert tod3["TOD"] == 3 and tod3["TRIPS"] == 2 and tod3["HEADWAY"] == 60
+
+    # b1 has no ROUTE_ID but still runs over x; c1 has no start hour
+    assert sorted(line_trips["TRANSIT_LINE"]) == ["a1", "a2", "a3", "b1"]
+
+    link_tod = service_tables.link_table(itin_df, line_trips)
+    row = link_tod.iloc[0]
+    assert (row["ABB"], row["TOD"], row["TRIPS"], row["BUSES_PER_HOUR"]) == ("x", 3, 4.0, 2.0)
+
+def test_future_tables():
+
+    lines_df = pd.DataFrame({"TRANSIT_LINE": ["f1", "f2", "f3"], "HEADWAY": [10, 30, 0], "TOD": ["37", "0", "3"]})
+    itin_df = pd.DataFrame({"TRANSIT_LINE": ["f1", "f2", "f3"], "ABB": ["x", "x", "x"]})
+
+    route_tod, line_trips = service_tables.future_route_tables(lines_df)
+
+    assert sorted(route_tod[route_tod.TRANSIT_LINE == "f1"]["TOD"]) == [3, 7]
+    assert len(route_tod[route_tod.TRANSIT_LINE == "f2"]) == 8
+    assert "f3" not in set(route_tod.TRANSIT_LINE)
+
+    link_tod = service_tables.link_table(itin_df, line_trips).set_index("TOD")
+    assert np.isclose(link_tod.loc[3, "TRIPS"], 120 / 10 + 120 / 30)
+    assert np.isclose(link_tod.loc[3, "BUSES_PER_HOUR"], 6 + 2)
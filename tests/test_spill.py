@@ -0,0 +1,85 @@
+import os
+import sys
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+import spill
+
+COLUMNS = ["ANODE", "BNODE", "ABB", "MILES", "SRA"]
+ROWS = [
+    [101, 102, "101-102-1", 0.5, "A"],
+    [102, 103, "102-103-1", 1.25, None],
+    [None, 104, "x-104-1", 2.0, "B"],
+    [104, None, "104-x-1", 0.75, None],
+    [105, 106, "105-106-1", 3.5, "C"],
+    [106, 107, "106-107-1", 0.1, "D"],
+    [107, 108, "107-108-1", 0.2, None]
+]
+
+def spilled(tmp_path, key, chunk_size):
+
+    return spill.spill_rows(iter(ROWS), COLUMNS, str(tmp_path / "table"), key, chunk_size = chunk_size)
+
+@pytest.mark.parametrize("chunk_size", [2, 3, 250000])
+def test_single_key_matches_to_dict(tmp_path, chunk_size):
+
+    expected = pd.DataFrame(ROWS, columns = COLUMNS).set_index("ABB").to_dict("index")
+    table = spilled(tmp_path, "ABB", chunk_size)
+
+    assert len(table) == len(expected)
+    for abb, attrs in expected.items():
+        assert abb in table
+        got = table[abb]
+        for field, value in attrs.items():
+            if pd.isna(value):
+                assert got[field] is None or pd.isna(got[field])
+            else:
+                assert got[field] == value
+
+    assert "nope" not in table
+    with pytest.raises(KeyError):
+        table["nope"]
+
+    table.close()
+
+@pytest.mark.parametrize("chunk_size", [2, 3, 250000])
+def test_composite_key_with_nulls_matches_to_dict(tmp_path, chunk_size):
+
+    # a null ANODE/BNODE turns the chunk's column to float; lookups by int must still hit
+    df = pd.DataFrame(ROWS, columns = COLUMNS)
+    expected = df.dropna(subset = ["ANODE", "BNODE"]).astype({"ANODE": int, "BNODE": int}).set_index(["ANODE", "BNODE"]).to_dict("index")
+    table = spilled(tmp_path, ["ANODE", "BNODE"], chunk_size)
+
+    for (anode, bnode), attrs in expected.items():
+        assert (anode, bnode) in table
+        assert (float(anode), float(bnode)) in table
+        assert table[(anode, bnode)]["ABB"] == attrs["ABB"]
+        assert table[(anode, bnode)]["MILES"] == attrs["MILES"]
+
+    assert (101, 103) not in table
+    table.close()
+
+def test_duplicate_keys_raise(tmp_path):
+
+    rows = ROWS + [[101, 102, "dup", 1.0, None]]
+
+    for chunk_size in [2, 250000]:
+        with pytest.raises(ValueError):
+            spill.spill_rows(iter(rows), COLUMNS, str(tmp_path / f"dup{chunk_size}"), ["ANODE", "BNODE"], chunk_size = chunk_size)
+
+def test_frame_and_select(tmp_path):
+
+    table = spilled(tmp_path, "ABB", 3)
+
+    frame = table.frame(["ABB", "MILES"]).sort_values("ABB").reset_index(drop = True)
+    expected = pd.DataFrame(ROWS, columns = COLUMNS)[["ABB", "MILES"]].sort_values("ABB").reset_index(drop = True)
+    assert frame["ABB"].tolist() == expected["ABB"].tolist()
+    assert frame["MILES"].tolist() == expected["MILES"].tolist()
+
+    selected = table.select("ABB", {"102-103-1", "106-107-1", "missing"}).sort_values("ABB")
+    assert selected["ABB"].tolist() == ["102-103-1", "106-107-1"]
+    assert selected["SRA"].tolist() == [None, "D"]
+
+    table.close()